@@ -1,15 +1,18 @@
 import os
 import csv
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone, timedelta
 import pandas as pd
 import numpy as np
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 from tinkoff.invest import Client, InstrumentShort
 from tinkoff.invest.constants import INVEST_GRPC_API
 
-from globals import STATS_FOLDER
-from globals import cndResDict
+from globals import STATS_FOLDER, CANDLES_FOLDER
+from globals import cndResDict, minutes_in_candle_interval
+from globals import CANDLES_DOWNLOAD_CHUNK, CANDLES_DOWNLOAD_WORKERS, CANDLES_DOWNLOAD_RETRIES, CANDLES_DOWNLOAD_BACKOFF, SERIES_INDEX_CACHE_SIZE
 from utils import is_it_holiday, setup_logger, is_it_early_mornining, is_it_late_evening, quote2float, get_account_token
 from readsettings import StrategySettings
 
@@ -17,6 +20,361 @@ logger = setup_logger(__name__)
 
 Tick = namedtuple('Tick', ['Time','Open','Close','Low','High','Volume'])
 
+class CandleWindow:
+    '''Read-only view of candles[start:end] which doesn't copy candles. Works like a list of Tick:
+       negative indexes are counted from the end of the window, slice of the window is another window over the same candles'''
+    __slots__ = ("candles", "start", "end")
+
+    def __init__(self, candles, start: int, end: int) -> None:
+        self.candles = candles
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, key):
+        length = self.end - self.start
+        if isinstance(key, slice):
+            start, stop, step = key.indices(length)
+            if step != 1:
+                return [self.candles[self.start + i] for i in range(start, stop, step)]
+            return CandleWindow(self.candles, self.start + start, self.start + max(start, stop))
+
+        if key < 0:
+            key += length
+        if key < 0 or key >= length:
+            raise IndexError(f"CandleWindow index out of range: {key}, len={length}")
+        return self.candles[self.start + key]
+
+    def __iter__(self):
+        return map(self.candles.__getitem__, range(self.start, self.end))
+
+    def __reversed__(self):
+        return map(self.candles.__getitem__, range(self.end - 1, self.start - 1, -1))
+
+    def copy(self) -> list[Tick]:
+        return [self.candles[i] for i in range(self.start, self.end)]
+
+class CandleSeries:
+    '''Candles stored as numpy columns: Time - int64 epoch seconds, Open/Close/Low/High - float64, Volume - int64.
+       Works like a list of Tick (Tick is made from the columns on first access and then reused), but slice of the series is a view 
+       over the same columns and column() returns prices without building Tick objects'''
+    __slots__ = ("columns", "ticks", "start", "end", "tz")
+
+    def __init__(self, ticks: list[Tick] = (), tz=timezone.utc) -> None:
+        ticks = ticks if isinstance(ticks, list) else list(ticks)
+        self.tz = ticks[0].Time.tzinfo if ticks else tz
+        self.columns: dict[str, np.ndarray] = {
+            "Time": np.array([int(t.Time.timestamp()) for t in ticks], dtype=np.int64),
+            "Open": np.array([t.Open for t in ticks], dtype=np.float64),
+            "Close": np.array([t.Close for t in ticks], dtype=np.float64),
+            "Low": np.array([t.Low for t in ticks], dtype=np.float64),
+            "High": np.array([t.High for t in ticks], dtype=np.float64),
+            "Volume": np.array([t.Volume for t in ticks], dtype=np.int64)}
+        self.ticks: list[Tick] = [None]*len(ticks)
+        self.start = 0
+        self.end = len(ticks)
+
+    def _view(self, start: int, end: int):
+        view = CandleSeries.__new__(CandleSeries)
+        view.columns = self.columns
+        view.ticks = self.ticks
+        view.tz = self.tz
+        view.start = start
+        view.end = end
+        return view
+
+    def _tick(self, i: int) -> Tick:
+        tick = self.ticks[i]
+        if tick is None:
+            columns = self.columns
+            tick = Tick(datetime.fromtimestamp(columns["Time"].item(i), self.tz), columns["Open"].item(i), columns["Close"].item(i), 
+                        columns["Low"].item(i), columns["High"].item(i), columns["Volume"].item(i))
+            self.ticks[i] = tick
+        return tick
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, key):
+        length = self.end - self.start
+        if isinstance(key, slice):
+            start, stop, step = key.indices(length)
+            if step != 1:
+                return [self._tick(self.start + i) for i in range(start, stop, step)]
+            return self._view(self.start + start, self.start + max(start, stop))
+
+        if key < 0:
+            key += length
+        if key < 0 or key >= length:
+            raise IndexError(f"CandleSeries index out of range: {key}, len={length}")
+        return self._tick(self.start + key)
+
+    def __iter__(self):
+        return map(self._tick, range(self.start, self.end))
+
+    def __reversed__(self):
+        return map(self._tick, range(self.end - 1, self.start - 1, -1))
+
+    def copy(self) -> list[Tick]:
+        return list(self)
+
+    def column(self, field: str) -> np.ndarray:
+        '''Values of one field of all candles (view, not a copy). Time is in epoch seconds'''
+        return self.columns[field][self.start:self.end]
+
+    def __getstate__(self):
+        #Tick objects are not sent to other processes, they are made again from the columns
+        return {"columns": self.columns, "start": self.start, "end": self.end, "tz": self.tz}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.ticks = [None]*len(self.columns["Time"])
+
+def get_column(candles, field: str, start: int = None, end: int = None) -> list:
+    '''Values of "field" of candles[start:end] as a list of floats. 
+       For CandleSeries (and CandleWindow over it) values are taken from the columns without building Tick objects'''
+    if isinstance(candles, CandleWindow) and isinstance(candles.candles, CandleSeries):
+        candles = candles.candles[candles.start:candles.end]
+    if isinstance(candles, CandleSeries):
+        return candles.column(field)[start:end].tolist()
+    return [getattr(candle, field) for candle in candles[start:end]]
+
+class DayIndex:
+    '''Day boundaries of a candle series, built once per series (see get_day_index()). New day starts where Time.day of a candle differs
+       from the previous candle. Keeps start/end bar offsets and Open/High/Low/Close of every day, min/max Close of the day up to every bar
+       and number of candles left until market close for every bar, so day-based values are looked up instead of scanning candles backwards'''
+    def __init__(self, candles) -> None:
+        utc_offset = candles.tz.utcoffset(None) if isinstance(candles, CandleSeries) else None
+        if utc_offset is not None:
+            self.time = candles.column("Time")
+            local_time = self.time + int(utc_offset.total_seconds())
+            dates = (local_time // 86400).astype("datetime64[D]")
+            day = (dates - dates.astype("datetime64[M]")).astype(np.int64) + 1
+            self.seconds = local_time % 86400
+        else:
+            times = [candle.Time for candle in candles]
+            self.time = np.array([int(t.timestamp()) for t in times], dtype=np.int64)
+            day = np.array([t.day for t in times], dtype=np.int64)
+            self.seconds = np.array([t.hour*3600 + t.minute*60 + t.second for t in times], dtype=np.int64)
+
+        self.close = np.array(get_column(candles, "Close"), dtype=float)
+        self.low = np.array(get_column(candles, "Low"), dtype=float)
+        self.high = np.array(get_column(candles, "High"), dtype=float)
+
+        new_day = np.ones(len(day), dtype=bool)
+        new_day[1:] = day[1:] != day[:-1]
+        self.day_start = np.flatnonzero(new_day)
+        self.day_end = np.append(self.day_start[1:], len(day)).astype(np.int64)
+        self.day_of_bar = np.cumsum(new_day) - 1
+
+        #daily OHLC
+        opens = np.array(get_column(candles, "Open"), dtype=float)
+        self.day_open = opens[self.day_start]
+        self.day_close = self.close[self.day_end - 1]
+        self.day_high = np.maximum.reduceat(self.high, self.day_start) if len(day) else np.empty(0)
+        self.day_low = np.minimum.reduceat(self.low, self.day_start) if len(day) else np.empty(0)
+
+        #min/max Close from the start of the day up to every bar
+        self.close_min = np.empty(len(day))
+        self.close_max = np.empty(len(day))
+        for start, end in zip(self.day_start, self.day_end):
+            self.close_min[start:end] = np.minimum.accumulate(self.close[start:end])
+            self.close_max[start:end] = np.maximum.accumulate(self.close[start:end])
+
+        self.bars_to_close_cache: dict[tuple, np.ndarray] = {}
+
+    def prev_day_hlc(self, start: int, end: int) -> tuple[float, float, float]:
+        '''Close, High and Low of the day before the day of bar end-1. Only bars start+1..end-1 are taken into account'''
+        day = self.day_of_bar[end-1]
+        prev_day_end = self.day_start[day]
+        if prev_day_end - 1 <= start:
+            raise ValueError(f"No previous day in candles [{start}:{end}]")
+
+        if self.day_start[day-1] > start:
+            high, low = self.day_high[day-1], self.day_low[day-1]
+        else:
+            high, low = self.high[start+1:prev_day_end].max(), self.low[start+1:prev_day_end].min()
+        return self.close.item(prev_day_end-1), high.item(), low.item()
+
+    def last_day_close_range(self, start: int, end: int) -> tuple[float, float]:
+        '''Min and max Close of bars start..end-1 which belong to the day of bar end-1, plus the last bar of the day before it'''
+        last = end - 1
+        day_start = self.day_start[self.day_of_bar[last]]
+        if day_start < start:
+            return self.close[start:end].min().item(), self.close[start:end].max().item()
+
+        min_close, max_close = self.close_min.item(last), self.close_max.item(last)
+        if day_start > start:
+            prev_close = self.close.item(day_start-1)
+            min_close, max_close = min(min_close, prev_close), max(max_close, prev_close)
+        return min_close, max_close
+
+    def bars_to_close(self, market_close_time: datetime, candle_interval) -> np.ndarray:
+        '''Number of candles until the market close for every bar, same as utils.candles_until_end_of_day() for every candle'''
+        key = (market_close_time, candle_interval)
+        bars = self.bars_to_close_cache.get(key, None)
+        if bars is None:
+            close_time = market_close_time.time()
+            close_seconds = close_time.hour*3600 + close_time.minute*60 + close_time.second
+            before_close = (self.time < market_close_time.timestamp()) & (self.seconds < close_seconds)
+            bars = np.where(before_close, ((close_seconds - self.seconds)/60)//minutes_in_candle_interval[candle_interval], 0).astype(np.int64)
+            self.bars_to_close_cache[key] = bars
+        return bars
+
+class SwingIndex:
+    '''Swing lows/highs of a candle series: Low (High) which is the min (max) of 5 candles around it. Found once per series 
+       (see get_swing_index()) in one vectorized pass and kept as position of the latest swing low/high at or before every bar'''
+    def __init__(self, candles) -> None:
+        self.low = np.array(get_column(candles, "Low"), dtype=float)
+        self.high = np.array(get_column(candles, "High"), dtype=float)
+        self.last_swing_low = self._last_swings(self.low, np.min)
+        self.last_swing_high = self._last_swings(self.high, np.max)
+
+    @staticmethod
+    def _last_swings(values: np.ndarray, extremum) -> np.ndarray:
+        is_swing = np.zeros(len(values), dtype=bool)
+        if len(values) >= 5:
+            is_swing[2:-2] = values[2:-2] == extremum(np.lib.stride_tricks.sliding_window_view(values, 5), axis=1)
+        return np.maximum.accumulate(np.where(is_swing, np.arange(len(values)), -1)) if len(values) else np.empty(0, dtype=np.int64)
+
+    def _prev_swing(self, last_swings: np.ndarray, values: np.ndarray, start: int, end: int) -> float:
+        #swing point is confirmed by 2 candles after it and is not closer than 3 candles to start (as in backward scan of candles[start:end])
+        if end - 3 >= start + 3:
+            swing = last_swings.item(end-3)
+            if swing >= start + 3:
+                return values.item(swing)
+        return values.item(end-1)
+
+    def prev_swing_low(self, start: int, end: int) -> float:
+        '''Latest swing low of candles[start:end], Low of the last candle if there is none'''
+        return self._prev_swing(self.last_swing_low, self.low, start, end)
+
+    def prev_swing_high(self, start: int, end: int) -> float:
+        '''Latest swing high of candles[start:end], High of the last candle if there is none'''
+        return self._prev_swing(self.last_swing_high, self.high, start, end)
+
+#(index class, id of source of candles) -> (source of candles, number of candles, last candle time, index), least recently used first
+_series_indexes: OrderedDict[tuple, tuple] = OrderedDict()
+
+def _get_series_index(index_class, candles) -> tuple:
+    '''Index (DayIndex, SwingIndex) of the whole series which candles belong to (candles may be a list, CandleSeries or CandleWindow 
+       over them) and position [start, end) of candles in it. Indexes of SERIES_INDEX_CACHE_SIZE last used series are kept,
+       so switching between instruments (live bot walks several of them every tick) doesn't build them again'''
+    start, end = 0, len(candles)
+    if isinstance(candles, CandleWindow):
+        start, end = candles.start, candles.end
+        candles = candles.candles
+    if isinstance(candles, CandleSeries):
+        start, end = start + candles.start, end + candles.start
+        source = candles.columns
+        length = len(source["Time"])
+        last_time = None
+    else:
+        #list of candles may be appended by the caller, so it is checked by its length and last candle as well
+        source = candles
+        length = len(candles)
+        last_time = candles[-1].Time if length else None
+
+    key = (index_class, id(source))
+    cached = _series_indexes.get(key, None)
+    if cached is None or cached[0] is not source or cached[1] != length or cached[2] != last_time:
+        series = candles._view(0, length) if isinstance(candles, CandleSeries) else candles
+        cached = (source, length, last_time, index_class(series))
+        _series_indexes[key] = cached
+        if len(_series_indexes) > SERIES_INDEX_CACHE_SIZE:
+            _series_indexes.popitem(last=False)
+    _series_indexes.move_to_end(key)
+    return cached[3], start, end
+
+def get_day_index(candles) -> tuple[DayIndex, int, int]:
+    return _get_series_index(DayIndex, candles)
+
+def get_swing_index(candles) -> tuple[SwingIndex, int, int]:
+    return _get_series_index(SwingIndex, candles)
+
+class CandleStore:
+    '''Local storage of historical candles of one ticker with one interval (file CANDLES_FOLDER/<ticker>_<resolution>.npz).
+       Keeps all candles as received from the broker (without holidays/morning/evening filtering) 
+       and list of time ranges [from, to) which are already downloaded, so only missing ranges have to be requested'''
+    def __init__(self, ticker: str, resolution: str):
+        self.filename = os.path.join(CANDLES_FOLDER, ticker + "_" + resolution + ".npz")
+        self.candles: dict[int, Tick] = {}          #epoch seconds -> candle
+        self.ranges: list[list[int]] = []           #sorted, not overlapping [from, to) ranges in epoch seconds
+        self.was_updated = False
+        self._load()
+
+    def missing_ranges(self, startdate: datetime, enddate: datetime) -> list[tuple[datetime, datetime]]:
+        '''Parts of [startdate, enddate) which are not in the store'''
+        start, end = int(startdate.timestamp()), int(enddate.timestamp())
+        missing = []
+        for range_from, range_to in self.ranges:
+            if range_to <= start:
+                continue
+            if range_from >= end:
+                break
+            if range_from > start:
+                missing.append((start, range_from))
+            start = max(start, range_to)
+        if start < end:
+            missing.append((start, end))
+        return [(datetime.fromtimestamp(s, tz=timezone.utc), datetime.fromtimestamp(e, tz=timezone.utc)) for s, e in missing]
+
+    def add(self, ticks: list[Tick], startdate: datetime, enddate: datetime):
+        '''Adds candles downloaded for [startdate, enddate). Candles which are already in the store are replaced'''
+        for tick in ticks:
+            self.candles[int(tick.Time.timestamp())] = tick
+        self._add_range(int(startdate.timestamp()), int(enddate.timestamp()))
+        self.was_updated = True
+
+    def get(self, startdate: datetime, enddate: datetime) -> list[Tick]:
+        '''Candles from [startdate, enddate) sorted by time'''
+        start, end = int(startdate.timestamp()), int(enddate.timestamp())
+        return [self.candles[t] for t in sorted(self.candles) if start <= t < end]
+
+    def save(self):
+        if not self.was_updated:
+            return
+        if not os.path.exists(CANDLES_FOLDER):
+            os.makedirs(CANDLES_FOLDER)
+
+        times = sorted(self.candles)
+        ticks = [self.candles[t] for t in times]
+        np.savez(self.filename, time=np.array(times, dtype=np.int64),
+                 open=np.array([t.Open for t in ticks], dtype=float), close=np.array([t.Close for t in ticks], dtype=float),
+                 low=np.array([t.Low for t in ticks], dtype=float), high=np.array([t.High for t in ticks], dtype=float),
+                 volume=np.array([t.Volume for t in ticks], dtype=np.int64), ranges=np.array(self.ranges, dtype=np.int64).reshape(-1, 2))
+        self.was_updated = False
+
+    def _load(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with np.load(self.filename) as data:
+                for t, o, c, l, h, v in zip(data["time"].tolist(), data["open"].tolist(), data["close"].tolist(), 
+                                            data["low"].tolist(), data["high"].tolist(), data["volume"].tolist()):
+                    self.candles[t] = Tick(datetime.fromtimestamp(t, tz=timezone.utc), o, c, l, h, v)
+                self.ranges = data["ranges"].tolist()
+        except Exception:
+            logger.exception(f"CandleStore: can't read {self.filename}, all candles will be downloaded again", exc_info=True)
+            self.candles.clear()
+            self.ranges.clear()
+
+    def _add_range(self, start: int, end: int):
+        if start >= end:
+            return
+        #merge new range with all ranges it overlaps or touches
+        merged = []
+        for range_from, range_to in self.ranges:
+            if range_to < start or range_from > end:
+                merged.append([range_from, range_to])
+            else:
+                start, end = min(start, range_from), max(end, range_to)
+        merged.append([start, end])
+        self.ranges = sorted(merged)
+
 class Candles:
     def __init__(self, skip_holidays: bool = True, skip_morning_hours: bool = True, skip_evening_hours: bool = True) -> None:
         self.data: list[Tick] = []
@@ -32,36 +390,39 @@ class Candles:
         self.data.append(tick)
         return True
 
-    def collect(self, settings: StrategySettings, startdate, enddate, b_save=True) -> list[Tick]:
+    def collect(self, settings: StrategySettings, startdate, enddate, b_save=True, client_factory=None) -> list[Tick]:
+        '''Candles from startdate to enddate. Candles are taken from local CandleStore, only missing time ranges are downloaded.
+           CSV copy (b_save) is written only when something was downloaded.
+           client_factory - function which returns the client (context manager with get_all_candles), tinkoff Client by default'''
 
-        token = get_account_token(settings.acc_name)
-        instr: InstrumentShort = self._find_instrument(token, settings.ticker)
-        if not instr:
-            raise Exception("Candles.collect(): Can't find such ticker: ", settings.ticker)
+        resolution = list(cndResDict.keys())[list(cndResDict.values()).index(settings.candles_int)]
+        store = CandleStore(settings.ticker, resolution)
+        missing_ranges = store.missing_ranges(startdate, enddate)
+        if missing_ranges:
+            token = get_account_token(settings.acc_name)
+            instr: InstrumentShort = self._find_instrument(token, settings.ticker)
+            if not instr:
+                raise Exception("Candles.collect(): Can't find such ticker: ", settings.ticker)
+
+            for range_start, range_end in missing_ranges:
+                logger.info(f"Candles.collect(): downloading {settings.ticker} candles from {range_start} to {range_end}")
+            if not client_factory:
+                client_factory = lambda: Client(token)
+            failed = self._download(client_factory, instr.figi, settings.candles_int, missing_ranges, store)
+            #chunks downloaded before a failure are kept, only failed ones are requested next time
+            store.save()
+            if failed:
+                #candles would have a gap in history which strategies would take as continuous
+                raise Exception("Candles.collect(): Candles were not downloaded for some time ranges, try again later: ", settings.ticker, failed)
     
         self.data.clear()
-        for i in range(3):
-            try:
-                with Client(token) as client:
-                    for candle in client.get_all_candles(figi=instr.figi, from_=startdate, to=enddate,
-                                                         interval=settings.candles_int):
-            
-                        tick = Tick(candle.time, 
-                                    quote2float(candle.open), quote2float(candle.close), 
-                                    quote2float(candle.low), quote2float(candle.high), candle.volume)
-                        self.add(tick)
-                break
-            except Exception as e:
-                logger.error(f"Candles.collect(): Exception in get_all_candles: ", e)
-                self.data.clear()
-                time.sleep(30)
-                continue
+        for tick in store.get(startdate, enddate):
+            self.add(tick)
 
-        if b_save and len(self.data) > 0:
-            if not os.path.exists(STATS_FOLDER + '/' + instr.ticker): 
-                os.mkdir(STATS_FOLDER + '/' + instr.ticker)
-            resolution = list(cndResDict.keys())[list(cndResDict.values()).index(settings.candles_int)]
-            fileName = STATS_FOLDER + '/' + instr.ticker + "/" + instr.ticker + '_' + startdate.strftime('%Y-%m-%d') + '_' + enddate.strftime('%Y-%m-%d') + '_' + resolution + '.csv'
+        if b_save and missing_ranges and len(self.data) > 0:
+            if not os.path.exists(STATS_FOLDER + '/' + settings.ticker): 
+                os.mkdir(STATS_FOLDER + '/' + settings.ticker)
+            fileName = STATS_FOLDER + '/' + settings.ticker + "/" + settings.ticker + '_' + startdate.strftime('%Y-%m-%d') + '_' + enddate.strftime('%Y-%m-%d') + '_' + resolution + '.csv'
             with open(fileName, 'w', newline='') as csvFile:
                 historyWriter = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
                 historyWriter.writerow(['Time', 'Open', 'High', 'Low', 'Close', 'Volume']) #write csv header
@@ -70,19 +431,69 @@ class Candles:
                                             candle.Open, candle.High, candle.Low, candle.Close, candle.Volume])
         return self.data
 
-    def daily_price_change_avg(self) -> float:
-        
-        curr_day_close_values: list[float] = []
-        list_of_daily_price_change: list[float] = []
-        curr_day = self.data[0].Time.day
+    def _download(self, client_factory, figi: str, interval, time_ranges: list[tuple], store: CandleStore) -> int:
+        '''Downloads candles of all time ranges into the store. Ranges are split into chunks of CANDLES_DOWNLOAD_CHUNK candles,
+           which are downloaded by CANDLES_DOWNLOAD_WORKERS threads. Every downloaded chunk is added to the store, failed chunks 
+           are skipped (their time ranges are not marked as downloaded). Returns number of failed chunks'''
+
+        chunk_len = timedelta(minutes=minutes_in_candle_interval.get(interval, 1)*CANDLES_DOWNLOAD_CHUNK)
+        chunks = []
+        for range_start, range_end in time_ranges:
+            chunk_start = range_start
+            while chunk_start < range_end:
+                chunks.append((chunk_start, min(chunk_start + chunk_len, range_end)))
+                chunk_start += chunk_len
+        if not chunks:
+            return 0
 
-        for iter in self.data:
-            if curr_day != iter.Time.day:
-                list_of_daily_price_change.append(100.0*((max(curr_day_close_values) - min(curr_day_close_values))/curr_day_close_values[0]))
-                curr_day_close_values.clear()
-                curr_day = iter.Time.day
+        failed = 0
+        with ThreadPoolExecutor(max_workers=min(CANDLES_DOWNLOAD_WORKERS, len(chunks))) as executor:
+            futures = {executor.submit(self._download_chunk, client_factory, figi, interval, chunk[0], chunk[1]): chunk for chunk in chunks}
+            #the store is updated only from this thread
+            for future in as_completed(futures):
+                chunk_start, chunk_end = futures[future]
+                ticks, complete_until = future.result()
+                if ticks is None:
+                    failed += 1
+                    continue
+                store.add(ticks, chunk_start, complete_until)
 
-            curr_day_close_values.append(iter.Close)
+        if failed:
+            logger.error(f"Candles._download(): {failed} of {len(chunks)} chunks were not downloaded")
+        return failed
+
+    def _download_chunk(self, client_factory, figi: str, interval, startdate: datetime, enddate: datetime) -> tuple[list[Tick], datetime]:
+        '''Downloads candles from startdate to enddate. Returns candles and time until which the chunk is complete 
+           (the last candle may be still in progress, it must be downloaded again next time). Returns (None, None) if all attempts failed'''
+
+        for attempt in range(CANDLES_DOWNLOAD_RETRIES):
+            complete_until = min(enddate, datetime.now(timezone.utc) - timedelta(minutes=minutes_in_candle_interval.get(interval, 1)))
+            ticks = []
+            try:
+                with client_factory() as client:
+                    for candle in client.get_all_candles(figi=figi, from_=startdate, to=enddate, interval=interval):
+            
+                        ticks.append(Tick(candle.time, 
+                                          quote2float(candle.open), quote2float(candle.close), 
+                                          quote2float(candle.low), quote2float(candle.high), candle.volume))
+                        if not getattr(candle, "is_complete", True):
+                            complete_until = min(complete_until, candle.time)
+                return ticks, complete_until
+            except Exception as e:
+                delay = CANDLES_DOWNLOAD_BACKOFF*2**attempt
+                logger.error(f"Candles._download_chunk(): Exception in get_all_candles ({startdate} - {enddate}), attempt {attempt + 1}, retry in {delay}s: {e}")
+                if attempt + 1 < CANDLES_DOWNLOAD_RETRIES:
+                    time.sleep(delay)
+
+        return None, None
+
+    def daily_price_change_avg(self) -> float:
+        
+        day_index, _, _ = get_day_index(self.data)
+        first_close = day_index.close[day_index.day_start]
+        last = day_index.day_end - 1
+        #last day of data is not finished and is not counted
+        list_of_daily_price_change: list[float] = (100.0*((day_index.close_max[last] - day_index.close_min[last])/first_close))[:-1].tolist()
         
         return sum(list_of_daily_price_change)/len(list_of_daily_price_change)
 
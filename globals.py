@@ -25,9 +25,34 @@ WORK_DAYS_RATE = 0.67    #To get number of working days, get total number of day
 
 NANO_DIV = 1000000000
 
+#Candles download
+CANDLES_DOWNLOAD_CHUNK = 5000       #max number of candles requested by one get_all_candles call
+CANDLES_DOWNLOAD_WORKERS = 4        #chunks downloaded at the same time
+CANDLES_DOWNLOAD_RETRIES = 5        #attempts to download one chunk
+CANDLES_DOWNLOAD_BACKOFF = 2        #seconds to wait after first failed attempt, doubled after every next one
+SERIES_INDEX_CACHE_SIZE = 32        #day/swing indexes of candle series kept (one per index class and series, e.g. instruments of the bot)
+
+#Parameters search (paramsearch.py)
+HALVING_KEEP = 0.25                 #part of combinations which goes to the next (longer) step of successive halving
+HALVING_MIN_CANDIDATES = 20         #combinations which are run on the whole in-sample period in the end
+HALVING_MIN_CANDLES = 100           #shortest period (in candles) combinations are compared on
+HALVING_MIN_GROWTH = 2.0            #every step of successive halving is run on at least this times longer period than the step before
+TPE_STARTUP_RUNS = 16               #random combinations run before TPE starts to model good/bad parameters
+TPE_BATCH = 8                       #combinations sampled and run at once (may run in parallel)
+TPE_GOOD_PART = 0.25                #part of best combinations which are "good" for TPE
+TPE_CANDIDATES = 24                 #combinations sampled from "good" density to choose every next combination from
+TPE_SAMPLE_ATTEMPTS = 50            #attempts per combination to find random not tried valid combination
+REFINE_COARSE_STEP = 4              #coarse grid of refinement search uses this times bigger step of every parameter (power of 2)
+REFINE_TOP_K = 10                   #best combinations which neighbours are run on every refinement step
+ABORT_MIN_BARS_PER_ORDER = 1       #candles needed to add one order to a run of strategies without known order candles (one command per candle at most)
+CALENDAR_INDEX_CACHE_SIZE = 64      #test periods which calendar indexes of reports are kept for (sweep runs share a few periods)
+SWEEP_TOP_REPORTS = 100             #best reports kept in memory during the sweep for every selection criterion (others go to summary.log only)
+ROBUST_RADIUS = 1                   #neighbours of a combination (steps of every parameter to each side) scored by "Robust" selection
+
 #folders
 DATA_FOLDER = "data"
 INDICATORS_FOLDER = os.path.join(DATA_FOLDER, "indicators")
+CANDLES_FOLDER = os.path.join(DATA_FOLDER, "candles")
 LOGS_FOLDER = os.path.join(DATA_FOLDER, "logs")
 STATS_FOLDER = os.path.join(DATA_FOLDER, "stats")
 STRAT_ORDERS_FOLDER = os.path.join(DATA_FOLDER, "orders")
@@ -208,4 +233,5 @@ subscriptionIntervalDict = {
 '1mon'  :SubscriptionInterval.SUBSCRIPTION_INTERVAL_MONTH
 }
 
+#SMA/EMA values pre-calculated for the current sweep (indicatorvals.IndicatorsMatrix), set by strategytester.test_strategy
 SMA_INDICATORS_MATRIX = None
@@ -1,5 +1,7 @@
-from sys import maxsize
-from candles import Tick
+import math
+from collections import deque
+import numpy as np
+from candles import Tick, get_day_index
 
 class Indicators:
 
@@ -25,6 +27,37 @@ class Indicators:
 
         return ema
 
+    def sma_series(data: np.ndarray, period: int) -> np.ndarray:
+        '''SMA for every element of data (NaN while history is too short). 
+           Values are added in the same order as in Indicators.sma, so results are bit-identical'''
+        data = np.asarray(data, dtype=float)
+        sma = np.full(len(data), np.nan)
+        if period <= 0 or len(data) < period:
+            return sma
+
+        n = len(data) - period + 1
+        acc = np.zeros(n)
+        for j in range(period):
+            acc += data[j:j+n]
+        sma[period-1:] = acc/period
+        return sma
+
+    def ema_series(data: np.ndarray, period: int) -> np.ndarray:
+        '''EMA for every element of data, calculated as Indicators.ema does it on last 2*period values:
+           SMA of first "period" values is a seed, then "period" EMA steps. Bit-identical to Indicators.ema'''
+        data = np.asarray(data, dtype=float)
+        ema = np.full(len(data), np.nan)
+        if period <= 0 or len(data) < 2*period:
+            return ema
+
+        k = 2.0/(period + 1.0)
+        n = len(data) - 2*period + 1
+        prev_ema = Indicators.sma_series(data, period)[period-1:period-1+n]
+        for j in range(period):
+            prev_ema = (data[period+j:period+j+n] - prev_ema)*k + prev_ema
+        ema[2*period-1:] = prev_ema
+        return ema
+
     def smma(data, period):
 
         if period < 1:
@@ -38,6 +71,20 @@ class Indicators:
             prev_sma = (prev_sma*(period-1) + iter)/period
 
         return prev_sma
+
+    def smma_series(data: np.ndarray, period: int) -> np.ndarray:
+        '''SMMA for every element of data, calculated as Indicators.smma does it on last 2*period values. Bit-identical to Indicators.smma'''
+        data = np.asarray(data, dtype=float)
+        smma = np.full(len(data), np.nan)
+        if period < 1 or len(data) < 2*period:
+            return smma
+
+        n = len(data) - 2*period + 1
+        prev_sma = Indicators.sma_series(data, period)[period-1:period-1+n]
+        for j in range(period):
+            prev_sma = (prev_sma*(period-1) + data[period+j:period+j+n])/period
+        smma[2*period-1:] = prev_sma
+        return smma
     
     def alligator(data, jaw_p, teeth_p, lip_p, jaw_s, teeth_s, lip_s):
 
@@ -72,6 +119,18 @@ class Indicators:
 
         return macd[-1], signal_line, macd[-1]-signal_line    
 
+    def macd_series(data: np.ndarray, fast, slow, signal) -> tuple:
+        '''MACD, signal line and histogram for every element of data (NaN while history is too short).
+           MACD is the difference of ema_series, signal line is ema_series of MACD, so values are bit-identical 
+           to Indicators.macd, which calls Indicators.ema for every one of 2*signal MACD points'''
+        data = np.asarray(data, dtype=float)
+        macd = Indicators.ema_series(data, fast) - Indicators.ema_series(data, slow)
+        signal_line = np.full(len(data), np.nan)
+        first = 2*max(fast, slow) - 1
+        if len(data) > first:
+            signal_line[first:] = Indicators.ema_series(macd[first:], signal)
+        return macd, signal_line, macd - signal_line
+
     #the function below seems to be correct: chat GPT returned same value as this function did.
     def rsi(data: list, period: int = 14) -> float:
         """
@@ -110,6 +169,30 @@ class Indicators:
 
         return rsi
 
+    def rsi_series(data: np.ndarray, period: int = 14) -> np.ndarray:
+        '''RSI for every element of data (NaN while history is too short). 
+           Gains and losses are summed in the same order as in Indicators.rsi, so results are bit-identical'''
+        data = np.asarray(data, dtype=float)
+        rsi = np.full(len(data), np.nan)
+        if period <= 0 or len(data) < period + 1:
+            return rsi
+
+        delta = data[1:] - data[:-1]
+        gains = np.where(delta > 0, delta, 0.0)
+        losses = np.where(delta < 0, delta, 0.0)
+        n = len(delta) - period + 1
+        gain = np.zeros(n)
+        loss = np.zeros(n)
+        for j in range(period):
+            gain += gains[j:j+n]
+            loss += losses[j:j+n]
+        loss = -loss
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = 100 - (100 / (1 + gain/loss))
+        rsi[period:] = np.where(loss == 0, 100.0, values)
+        return rsi
+
     def stochastic(data, params):
         """
         Calculate the most recent %K and %D values of the Stochastic Oscillator.
@@ -159,6 +242,47 @@ class Indicators:
 
         return percent_k, percent_d
 
+    def stochastic_series(data: np.ndarray, params) -> tuple:
+        '''%K and %D of the Stochastic Oscillator for every element of data (NaN while history is too short).
+           Rolling min/max are taken in O(n) for any k_period (see Indicators.rolling_min_max), %D is made of the same %K values 
+           as in Indicators.stochastic (the oldest "smooth" of last d_period values), so results are bit-identical'''
+        k_period, d_period, smooth = params
+        if k_period < 1 or d_period < 1 or smooth < 1:
+            raise ValueError(f"Params are not suitable to calculate the Stochastic Oscillator: {k_period},{d_period},{smooth}")
+
+        data = np.asarray(data, dtype=float)
+        percent_k = np.full(len(data), np.nan)
+        percent_d = np.full(len(data), np.nan)
+        if len(data) < k_period:
+            return percent_k, percent_d
+
+        lowest_low, highest_high = Indicators.rolling_min_max(data, k_period)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            k_values = np.where(highest_high == lowest_low, 0.0, ((data[k_period-1:] - lowest_low) / (highest_high - lowest_low)) * 100)
+        percent_k[k_period-1:] = k_values
+
+        #%D of candle t = (K[t-(d-m)] + K[t-(d-m)-1] + ... + K[t-(d-1)])/smooth, m = min(smooth, d_period)
+        n = len(k_values) - d_period + 1
+        if n > 0:
+            acc = np.zeros(n)
+            for i in range(d_period - min(smooth, d_period), d_period):
+                acc += k_values[d_period-1-i:d_period-1-i+n]
+            percent_d[k_period+d_period-2:] = acc / smooth
+        return percent_k, percent_d
+
+    def rolling_min_max(data: np.ndarray, period: int) -> tuple:
+        '''Min and max of every window of "period" elements (len(data)-period+1 values each) in O(n) for any period:
+           data is cut into blocks of "period" elements, every window is a suffix of one block plus a prefix of the next one,
+           so its min/max is taken from running min/max of blocks (van Herk/Gil-Werman)'''
+        n = len(data)
+        blocks = np.pad(data, (0, -n % period), mode="edge").reshape(-1, period)
+        extremes = []
+        for func in (np.minimum, np.maximum):
+            prefix = func.accumulate(blocks, axis=1).ravel()
+            suffix = func.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+            extremes.append(func(suffix[:n-period+1], prefix[period-1:n]))
+        return tuple(extremes)
+
     def calculate_tr(high, low, close_prev):
         return max(high - low, abs(high - close_prev), abs(low - close_prev))
 
@@ -176,45 +300,70 @@ class Indicators:
         if len(low) < 2*(period+1):
             raise ValueError(f"Data lengh too small: len={len(low)}, expected {2*(period+1)}")
     
-        tr_list, plus_dm_list, minus_dm_list = [], [], []
-        for i in range(1, len(low)):
-        
-            tr = Indicators.calculate_tr(high[i], low[i], close[i-1])
-            plus_dm = max(high[i] - high[i-1], 0) if (high[i] - high[i-1]) > (low[i-1] - low[i]) else 0
-            minus_dm = max(low[i-1] - low[i], 0) if (low[i-1] - low[i]) > (high[i] - high[i-1]) else 0
-        
-            tr_list.append(tr)
-            plus_dm_list.append(plus_dm)
-            minus_dm_list.append(minus_dm)
-    
-        tr_smoothed = [Indicators.sma(tr_list[i:i+period], period) for i in range(len(tr_list)-period+1)]
-        plus_dm_smoothed = [Indicators.smma(plus_dm_list[i:i+2*period], period) for i in range(len(plus_dm_list)-2*period+1)]
-        minus_dm_smoothed = [Indicators.smma(minus_dm_list[i:i+2*period], period) for i in range(len(minus_dm_list)-2*period+1)]
-        tr_smoothed = tr_smoothed[-len(plus_dm_smoothed):]
-
-        plus_di = [100 * (plus_dm_smoothed[i] / tr_smoothed[i]) for i in range(len(tr_smoothed))]
-        minus_di = [100 * (minus_dm_smoothed[i] / tr_smoothed[i]) for i in range(len(tr_smoothed))]
-    
-        dx = [100 * abs(plus_di[i] - minus_di[i]) / (plus_di[i] + minus_di[i]) for i in range(len(plus_di))]
-    
-        adx = Indicators.smma(dx, period)
-        return adx, plus_di[-1], minus_di[-1]
+        adx, plus_di, minus_di = Indicators.adx_series(low, high, close, period)
+        if math.isnan(adx[-1]):
+            raise ValueError(f"Data lengh too small or no price changes: len={len(low)}, expected {4*period}")
+        return adx.item(-1), plus_di.item(-1), minus_di.item(-1)
+
+    def adx_series(low: np.ndarray, high: np.ndarray, close: np.ndarray, period=14) -> tuple:
+        '''ADX, +DI and -DI for every candle (NaN while history is too short) in one pass:
+           true range is smoothed by SMA, directional movements by SMMA, DX by SMMA (same formulas and order of operations as
+           the old Indicators.adx, which re-calculated SMA/SMMA for every window, so values are bit-identical)'''
+        low = np.asarray(low, dtype=float)
+        high = np.asarray(high, dtype=float)
+        n = len(low)
+        adx, plus_di, minus_di = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+        if n < 2*period + 1:
+            return adx, plus_di, minus_di
+
+        up = high[1:] - high[:-1]
+        down = low[:-1] - low[1:]
+        plus_dm = np.where(up > down, np.maximum(up, 0), 0.0)
+        minus_dm = np.where(down > up, np.maximum(down, 0), 0.0)
+
+        tr_smoothed = Indicators.sma_series(Indicators.true_range_series(low, high, close, absolute=True)[1:], period)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            plus_di[1:] = 100 * (Indicators.smma_series(plus_dm, period) / tr_smoothed)
+            minus_di[1:] = 100 * (Indicators.smma_series(minus_dm, period) / tr_smoothed)
+            dx = 100 * np.abs(plus_di - minus_di) / (plus_di + minus_di)
+
+        #DX is defined from candle 2*period
+        adx[2*period:] = Indicators.smma_series(dx[2*period:], period)
+        return adx, plus_di, minus_di
 
     def boilinger(data: list[float], period: int) -> tuple:
 
         if len(data) < 2*period:
             raise ValueError(f"Data lengh too small: len={len(data)}, expected {2*period}")
 
-        multiplier = 2.0
-        middle = Indicators.sma(data, period)
-
         #Standard deviation formula: sqrt (1/Period * SUM( (Price[i] - SMA)^2 ) )
         #Where i from 0 to Period; SMA - from Period
-        deviation = (sum([(data[i] - Indicators.sma(data[i+1-period:i+1], period))**2 for i in range(len(data)-period, len(data))])/period)**0.5
-
-        upper = middle + deviation*multiplier
-        lower = middle - deviation*multiplier
+        middle, upper, lower = Indicators.boilinger_series(data[-(2*period - 1):], period)
+
+        return middle.item(-1), upper.item(-1), lower.item(-1)
+
+    def boilinger_series(data: np.ndarray, period: int) -> tuple:
+        '''Middle, upper and lower bands for every element of data (NaN while history is too short).
+           Deviation is calculated as in Indicators.boilinger - from residuals of every price to its own SMA,
+           residuals are calculated once and summed in sliding windows. Windows are summed in "period" vector passes (O(n*period))
+           and not as differences of a cumulative sum (O(n)): the latter rounds differently, and values must be bit-identical 
+           to Indicators.boilinger so that IndicatorsMatrix and window calculation give the same trades (as sma_series)'''
+        data = np.asarray(data, dtype=float)
+        middle = Indicators.sma_series(data, period)
+        upper, lower = np.full(len(data), np.nan), np.full(len(data), np.nan)
+        if period <= 0 or len(data) < 2*period - 1:
+            return middle, upper, lower
+
+        squares = (data - middle)[period-1:]**2
+        n = len(squares) - period + 1
+        acc = np.zeros(n)
+        for j in range(period):
+            acc += squares[j:j+n]
+        deviation = (acc/period)**0.5
 
+        multiplier = 2.0
+        upper[2*period-2:] = middle[2*period-2:] + deviation*multiplier
+        lower[2*period-2:] = middle[2*period-2:] - deviation*multiplier
         return middle, upper, lower
 
     def atr(candles: list[Tick], period: int) -> float:
@@ -226,30 +375,36 @@ class Indicators:
         true_range = [max(candles[i].High - candles[i].Low, candles[i].High - candles[i-1].Close, candles[i].Low - candles[i-1].Close) for i in range(candles_num - 2*period, candles_num)]
 
         return Indicators.ema(true_range, period)
+
+    def true_range_series(low: np.ndarray, high: np.ndarray, close: np.ndarray, absolute: bool = False) -> np.ndarray:
+        '''True range of every candle (NaN for the first candle).
+           absolute=False - as in Indicators.atr: max(high-low, high-prev_close, low-prev_close), gaps down are not counted;
+           absolute=True - as in Indicators.calculate_tr (used by ADX): max(high-low, |high-prev_close|, |low-prev_close|)'''
+        low = np.asarray(low, dtype=float)
+        high = np.asarray(high, dtype=float)
+        close = np.asarray(close, dtype=float)
+        true_range = np.full(len(close), np.nan)
+        if len(close) > 1:
+            to_high, to_low = high[1:] - close[:-1], low[1:] - close[:-1]
+            if absolute:
+                to_high, to_low = np.abs(to_high), np.abs(to_low)
+            true_range[1:] = np.maximum(np.maximum(high[1:] - low[1:], to_high), to_low)
+        return true_range
+
+    def atr_series(low: np.ndarray, high: np.ndarray, close: np.ndarray, period: int) -> np.ndarray:
+        '''ATR for every candle (NaN while history is too short). Bit-identical to Indicators.atr'''
+        atr = np.full(len(close), np.nan)
+        if len(close) < 2*period + 1:
+            return atr
+        atr[1:] = Indicators.ema_series(Indicators.true_range_series(low, high, close)[1:], period)
+        return atr
     
 
     def dailypivotpoints(candles: list[Tick]) -> tuple:
         
-        curr_day = candles[-1].Time.day
-        prev_day = -1
-        for i in range(-1, -len(candles), -1):
-            if candles[i].Time.day != curr_day:
-                prev_day = candles[i].Time.day
-                prev_day_index = i
-                break
-        
-        prev_day_close = candles[prev_day_index].Close
-        prev_day_high = -1
-        prev_day_low = maxsize
-
-        for i in range(prev_day_index, -len(candles), -1):
-            if prev_day == candles[i].Time.day:
-                if candles[i].High > prev_day_high: 
-                    prev_day_high = candles[i].High
-                if candles[i].Low < prev_day_low: 
-                    prev_day_low = candles[i].Low
-            else:
-                break
+        #previous day values are taken from the day index of the series instead of scanning candles backwards
+        day_index, start, end = get_day_index(candles)
+        prev_day_close, prev_day_high, prev_day_low = day_index.prev_day_hlc(start, end)
 
         p  = (prev_day_close + prev_day_high + prev_day_low)/3
         r1 = 2*p - prev_day_low
@@ -259,6 +414,399 @@ class Indicators:
 
         return r1, s1, r2, s2
 
+#Streaming (incremental) indicators for code that gets candles one by one (e.g. live bot). Every state is fed with candles one by one
+#and updates its value in O(1), instead of re-calculating the indicator from a slice of prices on every candle. Value is None until 
+#there is enough history. Values follow the same formulas as Indicators.* functions, but running sums are rounded differently: 
+#values differ from Indicators.* by up to ~1e-15 of the price (e.g. 8e-13 for prices about 200 on 6000 candles). It is enough 
+#for signals, but a near-tie cross of two averages may flip on it. So backtest get_* helpers of strategies use Indicators.* 
+#and IndicatorsMatrix, which give identical values in every engine, and not these states.
+
+#running sums are re-calculated from the window once per this number of updates, so rounding errors don't accumulate
+STATE_RESUM_PERIOD = 1000
+
+class SMAState:
+    '''Streaming Indicators.sma: running sum of last "period" prices'''
+    def __init__(self, period: int):
+        if period <= 0:
+            raise ValueError(f"Wrong period: {period}")
+        self.period = period
+        self.window: deque[float] = deque(maxlen=period)
+        self.total = 0.0
+        self.updates = 0
+        self.value: float = None
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, tick: Tick) -> float:
+        return self.add(tick.Close)
+
+    def add(self, price: float) -> float:
+        if len(self.window) == self.period:
+            self.total -= self.window[0]
+        self.window.append(price)
+        self.total += price
+
+        self.updates += 1
+        if self.updates % STATE_RESUM_PERIOD == 0:
+            self.total = sum(self.window)
+
+        if len(self.window) == self.period:
+            self.value = self.total/self.period
+        return self.value
+
+class WindowedEMAState:
+    '''Streaming version of EMA which is seeded on every candle as Indicators.ema/smma do: SMA of prices [t-2p+1 .. t-p] is the seed,
+       then "period" smoothing steps on prices [t-p+1 .. t]. Unrolled, it is 
+           value = (1-k)^p * seed + sum(k*(1-k)^j * price[t-j]), j = 0..p-1
+       The sum is updated recursively: sum_t = k*price_t + (1-k)*sum_(t-1) - k*(1-k)^p * price_(t-p)'''
+    def __init__(self, period: int, k: float):
+        if period <= 0:
+            raise ValueError(f"Wrong period: {period}")
+        self.period = period
+        self.k = k
+        self.decay = (1.0 - k)**period
+        self.window: deque[float] = deque(maxlen=2*period)
+        self.seed_total = 0.0  #sum of older half of the window
+        self.weighted = 0.0    #sum of k*(1-k)^j * price[t-j] for newer half of the window
+        self.updates = 0
+        self.value: float = None
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, tick: Tick) -> float:
+        return self.add(tick.Close)
+
+    def add(self, price: float) -> float:
+        p = self.period
+        if len(self.window) == 2*p:
+            self.seed_total -= self.window[0]
+        if len(self.window) >= p:
+            #price leaves newer half and becomes a part of the seed
+            leaving = self.window[-p]
+            self.seed_total += leaving
+            self.weighted -= self.k*self.decay*leaving/(1.0 - self.k) if self.k < 1.0 else 0.0
+        self.weighted = self.k*price + (1.0 - self.k)*self.weighted
+        self.window.append(price)
+
+        self.updates += 1
+        if self.updates % STATE_RESUM_PERIOD == 0:
+            self._resum()
+
+        if len(self.window) == 2*p:
+            self.value = self.decay*self.seed_total/p + self.weighted
+        return self.value
+
+    def _resum(self):
+        p = self.period
+        prices = list(self.window)
+        self.seed_total = sum(prices[:-p]) if len(prices) > p else 0.0
+        self.weighted = 0.0
+        for price in prices[-p:]:
+            self.weighted = self.k*price + (1.0 - self.k)*self.weighted
+
+class EMAState(WindowedEMAState):
+    '''Streaming Indicators.ema'''
+    def __init__(self, period: int):
+        super().__init__(period, 2.0/(period + 1.0))
+
+class SMMAState(WindowedEMAState):
+    '''Streaming Indicators.smma'''
+    def __init__(self, period: int):
+        super().__init__(period, 1.0/period)
+
+class RSIState:
+    '''Streaming Indicators.rsi: running sums of gains and losses of last "period" price changes.
+       With wilder=True average gain/loss are smoothed by Wilder (seeded by simple average of first "period" changes)'''
+    def __init__(self, period: int = 14, wilder: bool = False):
+        if period <= 0:
+            raise ValueError("Period must be greater than zero")
+        self.period = period
+        self.wilder = wilder
+        self.deltas: deque[float] = deque(maxlen=period)
+        self.gain = 0.0
+        self.loss = 0.0
+        self.losses_num = 0  #number of negative changes in the window (to detect zero loss exactly)
+        self.prev_price: float = None
+        self.updates = 0
+        self.value: float = None
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, tick: Tick) -> float:
+        return self.add(tick.Close)
+
+    def add(self, price: float) -> float:
+        if self.prev_price is None:
+            self.prev_price = price
+            return self.value
+        delta = price - self.prev_price
+        self.prev_price = price
+
+        if self.wilder:
+            return self._add_wilder(delta)
+
+        if len(self.deltas) == self.period:
+            old = self.deltas[0]
+            if old > 0: self.gain -= old
+            elif old < 0:
+                self.loss += old
+                self.losses_num -= 1
+        self.deltas.append(delta)
+        if delta > 0: self.gain += delta
+        elif delta < 0:
+            self.loss -= delta
+            self.losses_num += 1
+
+        self.updates += 1
+        if self.updates % STATE_RESUM_PERIOD == 0:
+            self.gain = sum(x for x in self.deltas if x > 0)
+            self.loss = -sum(x for x in self.deltas if x < 0)
+
+        if len(self.deltas) == self.period:
+            self.value = 100.0 if self.losses_num == 0 else 100 - (100 / (1 + self.gain/self.loss))
+        return self.value
+
+    def _add_wilder(self, delta: float) -> float:
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+        if len(self.deltas) < self.period:
+            #seed: simple averages of first "period" changes
+            self.deltas.append(delta)
+            self.gain += gain/self.period
+            self.loss += loss/self.period
+            if len(self.deltas) < self.period:
+                return self.value
+        else:
+            self.gain = (self.gain*(self.period - 1) + gain)/self.period
+            self.loss = (self.loss*(self.period - 1) + loss)/self.period
+
+        self.value = 100.0 if self.loss == 0 else 100 - (100 / (1 + self.gain/self.loss))
+        return self.value
+
+class ATRState:
+    '''Streaming Indicators.atr: true range of every candle smoothed by EMAState'''
+    def __init__(self, period: int):
+        self.period = period
+        self.ema = EMAState(period)
+        self.prev_close: float = None
+        self.value: float = None
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, tick: Tick) -> float:
+        if self.prev_close is not None:
+            #same true range formula as in Indicators.atr
+            true_range = max(tick.High - tick.Low, tick.High - self.prev_close, tick.Low - self.prev_close)
+            self.value = self.ema.add(true_range)
+        self.prev_close = tick.Close
+        return self.value
+
+class MACDState:
+    '''Streaming Indicators.macd: fast and slow EMAState give MACD, one more EMAState on MACD values gives the signal line.
+       Every state is updated in O(1), values match Indicators.macd within floating point rounding (relative error ~1e-12)'''
+    def __init__(self, fast: int, slow: int, signal: int):
+        if fast < 1 or slow < 1 or signal < 1:
+            raise ValueError(f"Wrong input parameters: {fast}, {slow}, {signal}")
+        self.fast = EMAState(fast)
+        self.slow = EMAState(slow)
+        self.signal = EMAState(signal)
+        #same history as Indicators.macd requires
+        self.needed_len = max(2*slow + 2*signal, 2*fast + 2*signal - 1)
+        self.count = 0
+        self.value: tuple = None  #(macd, signal line, histogram)
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, tick: Tick) -> tuple:
+        return self.add(tick.Close)
+
+    def add(self, price: float) -> tuple:
+        self.count += 1
+        fast = self.fast.add(price)
+        slow = self.slow.add(price)
+        if fast is None or slow is None:
+            return self.value
+        macd = fast - slow
+        signal_line = self.signal.add(macd)
+        if signal_line is not None and self.count >= self.needed_len:
+            self.value = (macd, signal_line, macd - signal_line)
+        return self.value
+
+class ADXState:
+    '''Streaming Indicators.adx: SMA of true range, SMMA of directional movements and SMMA of DX are updated in O(1) per candle.
+       Value is (adx, +DI, -DI)'''
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.true_range = SMAState(period)
+        self.plus_dm = SMMAState(period)
+        self.minus_dm = SMMAState(period)
+        self.dx = SMMAState(period)
+        self.prev_tick: Tick = None
+        self.value: tuple = None
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, tick: Tick) -> tuple:
+        prev = self.prev_tick
+        self.prev_tick = tick
+        if prev is None:
+            return self.value
+
+        up = tick.High - prev.High
+        down = prev.Low - tick.Low
+        true_range = self.true_range.add(Indicators.calculate_tr(tick.High, tick.Low, prev.Close))
+        plus_dm = self.plus_dm.add(max(up, 0) if up > down else 0)
+        minus_dm = self.minus_dm.add(max(down, 0) if down > up else 0)
+        if not true_range or plus_dm is None or minus_dm is None:
+            return self.value
+
+        plus_di = 100 * (plus_dm / true_range)
+        minus_di = 100 * (minus_dm / true_range)
+        if plus_di + minus_di > 0:
+            adx = self.dx.add(100 * abs(plus_di - minus_di) / (plus_di + minus_di))
+            if adx is not None:
+                self.value = (adx, plus_di, minus_di)
+        return self.value
+
+class BollingerState:
+    '''Streaming Indicators.boilinger: SMAState gives the middle band, squared residuals of prices to their SMA are summed
+       in a sliding window (running sum). Value is (middle, upper, lower)'''
+    def __init__(self, period: int, multiplier: float = 2.0):
+        self.period = period
+        self.multiplier = multiplier
+        self.sma = SMAState(period)
+        self.squares: deque[float] = deque(maxlen=period)
+        self.total = 0.0
+        self.updates = 0
+        self.value: tuple = None
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, tick: Tick) -> tuple:
+        return self.add(tick.Close)
+
+    def add(self, price: float) -> tuple:
+        middle = self.sma.add(price)
+        if middle is None:
+            return self.value
+
+        if len(self.squares) == self.period:
+            self.total -= self.squares[0]
+        square = (price - middle)**2
+        self.squares.append(square)
+        self.total += square
+
+        self.updates += 1
+        if self.updates % STATE_RESUM_PERIOD == 0:
+            self.total = sum(self.squares)
+
+        #Indicators.boilinger needs 2*period prices
+        if len(self.squares) == self.period and self.sma.updates >= 2*self.period:
+            deviation = (max(self.total, 0.0)/self.period)**0.5
+            self.value = (middle, middle + deviation*self.multiplier, middle - deviation*self.multiplier)
+        return self.value
+
+class StochasticState:
+    '''Streaming Indicators.stochastic: lowest/highest price of last k_period candles are kept in monotonic deques 
+       (O(1) amortized per candle), last d_period %K values give %D. Value is (%K, %D)'''
+    def __init__(self, k_period: int, d_period: int, smooth: int = 1):
+        if k_period < 1 or d_period < 1 or smooth < 1:
+            raise ValueError(f"Params are not suitable to calculate the Stochastic Oscillator: {k_period},{d_period},{smooth}")
+        self.k_period = k_period
+        self.d_period = d_period
+        self.smooth = smooth
+        self.lows: deque[tuple] = deque()   #(index, price), prices are increasing
+        self.highs: deque[tuple] = deque()  #(index, price), prices are decreasing
+        self.k_values: deque[float] = deque(maxlen=d_period)
+        self.count = 0
+        self.value: tuple = None
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, tick: Tick) -> tuple:
+        return self.add(tick.Close)
+
+    def add(self, price: float) -> tuple:
+        i = self.count
+        self.count += 1
+        while self.lows and self.lows[-1][1] >= price:
+            self.lows.pop()
+        self.lows.append((i, price))
+        while self.highs and self.highs[-1][1] <= price:
+            self.highs.pop()
+        self.highs.append((i, price))
+        #drop prices which are out of the window
+        while self.lows[0][0] <= i - self.k_period:
+            self.lows.popleft()
+        while self.highs[0][0] <= i - self.k_period:
+            self.highs.popleft()
+
+        if self.count < self.k_period:
+            return self.value
+
+        lowest_low, highest_high = self.lows[0][1], self.highs[0][1]
+        percent_k = 0 if highest_high == lowest_low else ((price - lowest_low) / (highest_high - lowest_low)) * 100
+        self.k_values.append(percent_k)
+        if len(self.k_values) == self.d_period:
+            #same %K values as in Indicators.stochastic: the oldest "smooth" of last d_period values
+            oldest = list(self.k_values)[:min(self.smooth, self.d_period)]
+            self.value = (percent_k, sum(reversed(oldest)) / self.smooth)
+        return self.value
+
+class StreamingIndicators:
+    '''Streaming indicator states of one instrument, one per (indicator, period). The owner (e.g. live bot, one set per instrument)
+       asks value_at() with its candles on every new candle: the state is fed only candles it has not seen yet, so every new candle 
+       costs O(1). Values are within float rounding of Indicators.* (see above). Period of indicators with several parameters 
+       is a tuple, e.g. ("MACD", (12, 26, 9))'''
+    state_classes = {"SMA": SMAState, "EMA": EMAState, "SMMA": SMMAState, "RSI": RSIState, "ATR": ATRState, "MACD": MACDState, "ADX": ADXState,
+                     "BOLLINGER": BollingerState, "STOCHASTIC": StochasticState}
+
+    def __init__(self):
+        self.states: dict[tuple, object] = {}
+        self.seen: dict[tuple, tuple] = {}  #(indicator, period) -> (time of the last fed candle, value, time of the candle before, value)
+
+    def value_at(self, ind_name: str, period, candles: list[Tick], warmup: int):
+        '''Value on the last candle of "candles" (value on the candle before it is kept as well - strategies ask for both).
+           If candles don't continue the candles the state has seen (e.g. history was loaded again),
+           state is made again from last "warmup" candles. None if history is too short'''
+        key = (ind_name, period)
+        time = candles[-1].Time
+        seen = self.seen.get(key, None)
+        if seen and seen[0] == time:
+            return seen[1]
+        if seen and seen[2] == time:
+            return seen[3]
+
+        if seen and len(candles) > 1 and candles[-2].Time == seen[0]:
+            state = self.states[key]
+            first = len(candles) - 1
+        else:
+            state = self.state_classes[ind_name](*period) if isinstance(period, tuple) else self.state_classes[ind_name](period)
+            self.states[key] = state
+            seen = (None, None, None, None)
+            first = max(0, len(candles) - warmup)
+
+        for i in range(first, len(candles)):
+            seen = (candles[i].Time, state.update(candles[i]), seen[0], seen[1])
+        self.seen[key] = seen
+        return seen[1]
+
 #ema10 = Indicators.ema([414.35,415.6,414.6,417.15,416.9,415.55,417.0,416.8,417.5,419.15,420.75,422.65,428.1,427.5,426.8,422.3,423.0,425.5,424.25,429.75], 10)
 #print(ema10)
 
@@ -1,14 +1,20 @@
 import os
 import re
 import glob
+import math
 from datetime import datetime, timezone
 import pickle
+import numpy as np
 
+from indicators import Indicators
+from candles import get_column
 from utils import setup_logger
 from globals import INDICATORS_FOLDER
 
 logger = setup_logger(__name__)
 
+#Classes IndicatorAttr*/IndicatorValues* are the old format of pre-calculated values. 
+#They are kept only to read old .dat files, which are converted to IndicatorCache on load (see load_indicators_from_file)
 class IndicatorAttr:
     def __init__(self, time: datetime, p1=-1, p2=-1, p3=-1, p4=-1):
         self.time: datetime = time
@@ -69,20 +75,278 @@ class IndicatorValuesMACD:
         self.ind_name = indicator_name
         self.values: dict[IndicatorAttrMACD : list[float]] = {}
 
-indicators_class_map = {"SMA": IndicatorValuesSimple, "EMA": IndicatorValues, "SMMA": IndicatorValues, "ADX": IndicatorValues, "MACD": IndicatorValuesMACD, "RSI": IndicatorValuesSimple, "ATR": IndicatorValuesSimple}
+#number of lines of indicators with several values per candle (all other indicators have one value per candle)
+INDICATOR_WIDTH = {"ADX": 3, "MACD": 2}
+
+def epoch_of(time) -> int:
+    '''Candle time as int epoch seconds (time may be datetime or already int)'''
+    return time if isinstance(time, int) else int(time.timestamp())
+
+class IndicatorColumn:
+    '''Values of an indicator with one set of parameters. Saved values are in two files opened with memory mapping:
+       <path>.time - int64 epoch seconds of candles, <path>.vals - float64 values ("width" values per candle).
+       New values are kept in memory and appended to the files by save()'''
+    def __init__(self, path: str, width: int = 1):
+        self.path = path
+        self.width = width
+        self.times: np.ndarray = None
+        self.vals: np.ndarray = None
+        self.index: dict[int, int] = None  #epoch -> row in the files, read on first access
+        self.new: dict[int, float | tuple] = {}
+
+    def get(self, epoch: int, default=-1):
+        value = self.new.get(epoch, None)
+        if value is not None:
+            return value
+        if self.index is None:
+            self._open()
+        row = self.index.get(epoch, None)
+        if row is None:
+            return default
+        return self.vals.item(row) if self.width == 1 else tuple(self.vals[row].tolist())
+
+    def put(self, epoch: int, value) -> bool:
+        '''Stores value in memory. Returns False if value for this candle is already there'''
+        if self.index is None:
+            self._open()
+        if epoch in self.index or epoch in self.new:
+            return False
+        self.new[epoch] = value
+        return True
+
+    def save(self):
+        '''Appends new values to the files'''
+        if not self.new:
+            return
+        if self.index is None:
+            self._open()
+        rows = len(self.index)
+
+        #release memory mapping before writing to the files
+        self.times = None
+        self.vals = None
+        for ext, row_size in ((".time", 8), (".vals", 8*self.width)):
+            #drop the tail of the file, which could be left by interrupted save
+            if os.path.exists(self.path + ext) and os.path.getsize(self.path + ext) > rows*row_size:
+                os.truncate(self.path + ext, rows*row_size)
+
+        epochs = list(self.new.keys())
+        with open(self.path + ".time", "ab") as file:
+            file.write(np.array(epochs, dtype=np.int64).tobytes())
+        with open(self.path + ".vals", "ab") as file:
+            file.write(np.array(list(self.new.values()), dtype=np.float64).tobytes())
+
+        self.index.update(zip(epochs, range(rows, rows + len(epochs))))
+        self.new.clear()
+        self._map(len(self.index))
+
+    def _open(self):
+        rows = 0
+        if os.path.exists(self.path + ".time") and os.path.exists(self.path + ".vals"):
+            rows = min(os.path.getsize(self.path + ".time")//8, os.path.getsize(self.path + ".vals")//(8*self.width))
+        self._map(rows)
+        self.index = dict(zip(self.times.tolist(), range(rows))) if rows else {}
+
+    def _map(self, rows: int):
+        if rows == 0:
+            return
+        self.times = np.memmap(self.path + ".time", dtype=np.int64, mode="r", shape=(rows,))
+        self.vals = np.memmap(self.path + ".vals", dtype=np.float64, mode="r", shape=(rows, self.width) if self.width > 1 else (rows,))
+
+    def __getstate__(self):
+        #memory mapped files are opened again by the process which gets this column
+        state = self.__dict__.copy()
+        state["times"] = None
+        state["vals"] = None
+        state["index"] = None
+        return state
+
+class IndicatorCache:
+    '''Pre-calculated values of one indicator of one ticker, stored in folder INDICATORS_FOLDER/<ticker>_<indicator> 
+       as one IndicatorColumn per set of parameters. Value is a float or a tuple of floats (for indicators with several lines, like ADX or MACD).
+       Column files are opened on first access to the parameters, so loading the cache doesn't read anything.
+       All new values are written to the journal, so it's possible to get only values added after some moment (see mark/updates_since)'''
+    def __init__(self, ticker: str, indicator_name: str, folder: str = None):
+        self.ticker = ticker
+        self.ind_name = indicator_name
+        self.folder = folder if folder else os.path.join(INDICATORS_FOLDER, ticker + "_" + indicator_name)
+        self.width = INDICATOR_WIDTH.get(indicator_name, 1)
+        self.columns: dict[tuple, IndicatorColumn] = {}
+        self.journal: list[tuple] = []
+
+    def column(self, p1: int = -1, p2: int = -1, p3: int = -1) -> IndicatorColumn:
+        column = self.columns.get((p1, p2, p3), None)
+        if not column:
+            column = IndicatorColumn(os.path.join(self.folder, f"{p1}_{p2}_{p3}"), self.width)
+            self.columns[(p1, p2, p3)] = column
+        return column
+
+    def get(self, time, p1: int = -1, p2: int = -1, p3: int = -1, default=-1):
+        return self.column(p1, p2, p3).get(epoch_of(time), default)
+
+    def put(self, time, value, p1: int = -1, p2: int = -1, p3: int = -1):
+        epoch = epoch_of(time)
+        if self.column(p1, p2, p3).put(epoch, value):
+            self.journal.append((p1, p2, p3, epoch))
+
+    def put_many(self, times: list, values: list, p1: int = -1, p2: int = -1, p3: int = -1):
+        '''Stores values of the indicator with the same parameters for several candles'''
+        column = self.column(p1, p2, p3)
+        for time, value in zip(times, values):
+            epoch = epoch_of(time)
+            if column.put(epoch, value):
+                self.journal.append((p1, p2, p3, epoch))
+
+    def update(self, values: dict):
+        '''Merges values returned by updates_since() into the cache'''
+        for (p1, p2, p3, epoch), value in values.items():
+            self.put(epoch, value, p1, p2, p3)
+
+    def mark(self) -> int:
+        '''Current position of the journal'''
+        return len(self.journal)
+
+    def updates_since(self, mark: int) -> dict:
+        '''Values added after mark() returned "mark"'''
+        return {key: self.columns[key[:3]].new[key[3]] for key in self.journal[mark:] if key[3] in self.columns[key[:3]].new}
+
+    def save(self):
+        '''Appends new values of all columns to the files'''
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        for column in self.columns.values():
+            column.save()
+
+    def __getstate__(self):
+        #journal has a meaning only for this process, don't send it
+        state = self.__dict__.copy()
+        state["journal"] = []
+        return state
+
+def convert_legacy_indicators(legacy, folder: str = None) -> IndicatorCache:
+    '''Converts pickled pre-calculated values (IndicatorValues* or dict with packed int keys) into IndicatorCache'''
+    indicators = IndicatorCache(legacy.ticker, legacy.ind_name, folder)
+    for attr, value in legacy.values.items():
+        if isinstance(attr, int):
+            #key packed as (((epoch << 10 | p1+1) << 10 | p2+1) << 10) | p3+1
+            epoch, p1, p2, p3 = attr >> 30, (attr >> 20 & 0x3FF) - 1, (attr >> 10 & 0x3FF) - 1, (attr & 0x3FF) - 1
+        else:
+            epoch, p1, p2, p3 = epoch_of(attr.time), getattr(attr, "param1", -1), getattr(attr, "param2", -1), getattr(attr, "param3", -1)
+        if isinstance(value, list):
+            #old format kept unused values as -1 at the end of the list: EMA - [ema, -1, -1, -1], ADX - [adx, di+, di-, -1]
+            value = value[:3] if legacy.ind_name == "ADX" else value
+            value = value[0] if legacy.ind_name in ("EMA", "SMMA") else tuple(value)
+        indicators.column(p1, p2, p3).put(epoch, value)
+    return indicators
+
+#number of MACD/ADX/Stochastic series (parameters combinations) kept by IndicatorsMatrix
+SERIES_CACHE_SIZE = 64
+
+class IndicatorsMatrix:
+    '''SMA and EMA of one candles series for a set of periods, stored as dense "periods x candles" matrices (and MACD/ADX/Stochastic/Bollinger series on request).
+       Built once per sweep (globals.SMA_INDICATORS_MATRIX), so all parameters combinations read the same values instead of calculating them'''
+    def __init__(self, candles: list, periods: list[int]):
+        self.periods = sorted(set(p for p in periods if p > 0))
+        self.rows: dict[int, int] = {p: row for row, p in enumerate(self.periods)}
+        self.index: dict[datetime, int] = {c.Time: i for i, c in enumerate(candles)}
+
+        close = np.array(get_column(candles, "Close"), dtype=float)
+        self.close = close
+        self.low = np.array(get_column(candles, "Low"), dtype=float)
+        self.high = np.array(get_column(candles, "High"), dtype=float)
+        self.series: dict[tuple, tuple] = {}  #(indicator, params) -> tuple of series, calculated on first request
+        self.sma = np.empty((len(self.periods), len(close)))
+        self.ema = np.empty((len(self.periods), len(close)))
+        for row, period in enumerate(self.periods):
+            self.sma[row] = Indicators.sma_series(close, period)
+            self.ema[row] = Indicators.ema_series(close, period)
+
+    def get_sma(self, time: datetime, period: int) -> float:
+        '''SMA of candle with "time", -1 if it's not in the matrix'''
+        return self._get(self.sma, time, period)
+
+    def get_ema(self, time: datetime, period: int) -> float:
+        '''EMA of candle with "time", -1 if it's not in the matrix'''
+        return self._get(self.ema, time, period)
+
+    def get_macd(self, time: datetime, fast: int, slow: int, signal: int) -> tuple:
+        '''MACD and signal line of candle with "time", (-1, -1) if it's not in the matrix'''
+        values = self._get_series_values(("MACD", fast, slow, signal), time, lambda: Indicators.macd_series(self.close, fast, slow, signal)[:2])
+        return values if values else (-1, -1)
+
+    def get_adx(self, time: datetime, period: int) -> tuple:
+        '''ADX, +DI and -DI of candle with "time", (-1, -1, -1) if it's not in the matrix'''
+        values = self._get_series_values(("ADX", period), time, lambda: Indicators.adx_series(self.low, self.high, self.close, period))
+        return values if values else (-1, -1, -1)
+
+    def get_stochastic(self, time: datetime, k_period: int, d_period: int, smooth: int) -> tuple:
+        '''%K and %D of candle with "time", (-1, -1) if it's not in the matrix'''
+        values = self._get_series_values(("STOCHASTIC", k_period, d_period, smooth), time, 
+                                         lambda: Indicators.stochastic_series(self.close, [k_period, d_period, smooth]))
+        return values if values else (-1, -1)
+
+    def get_bollinger(self, time: datetime, period: int) -> tuple:
+        '''Middle, upper and lower bands of candle with "time", (-1, -1, -1) if it's not in the matrix'''
+        values = self._get_series_values(("BOLLINGER", period), time, lambda: Indicators.boilinger_series(self.close, period))
+        return values if values else (-1, -1, -1)
+
+    def _get_series_values(self, key: tuple, time: datetime, calculate) -> tuple:
+        '''Values of candle with "time" from series "key" (None if there are no values). 
+           Series is calculated once, last SERIES_CACHE_SIZE series are kept'''
+        i = self.index.get(time, None)
+        if i is None:
+            return None
+
+        series = self.series.pop(key, None)
+        if series is None:
+            series = calculate()
+            if len(self.series) >= SERIES_CACHE_SIZE:
+                #dict keeps order of use: the first one is the least recently used
+                self.series.pop(next(iter(self.series)))
+        self.series[key] = series
+
+        values = tuple(s.item(i) for s in series)
+        return None if any(math.isnan(v) for v in values) else values
+
+    def row(self, ind_name: str, period: int) -> np.ndarray:
+        '''All values of SMA/EMA with "period" (None if period is not in the matrix)'''
+        row = self.rows.get(period, None)
+        if row is None:
+            return None
+        return self.sma[row] if ind_name == "SMA" else self.ema[row]
+
+    def covers(self, candles: list) -> bool:
+        '''True if candles are the beginning of the series the matrix was built for'''
+        return len(candles) > 0 and self.index.get(candles[0].Time, -1) == 0 and self.index.get(candles[-1].Time, -1) == len(candles) - 1
+
+    def _get(self, matrix: np.ndarray, time: datetime, period: int) -> float:
+        row = self.rows.get(period, None)
+        i = self.index.get(time, None)
+        if row is None or i is None:
+            return -1
+        value = matrix.item(row, i)
+        return -1 if math.isnan(value) else value
 
 def load_indicators_from_file(ticker: str, indicator_name: str, filename: str = None):
+    '''Opens the store of pre-calculated values. If "filename" is given or the store doesn't exist yet, values are converted from pickled .dat file'''
     
+    #values from "<name>.dat" are converted into folder "<name>"
+    folder = os.path.splitext(filename)[0] if filename else None
+    indicators = IndicatorCache(ticker, indicator_name, folder)
+    if os.path.exists(indicators.folder):
+        return indicators
     if not filename: 
         filename = os.path.join(INDICATORS_FOLDER, ticker + "_" + indicator_name + "_values.dat")
 
-    logger.info(f"load_indicators_from_file(): loading {ticker}:{indicator_name} from {filename}")
     try:
         with open(filename, "rb") as file:
-            indicators = pickle.load(file)
+            legacy = pickle.load(file)
     except FileNotFoundError:
-        indicators = indicators_class_map[indicator_name](ticker, indicator_name)
-        save_indicators_to_file(indicators)
+        return indicators
+
+    logger.info(f"load_indicators_from_file(): converting {ticker}:{indicator_name} from {filename}")
+    indicators = convert_legacy_indicators(legacy, folder)
+    save_indicators_to_file(indicators)
 
     return indicators
 
@@ -101,15 +365,10 @@ def load_indicators_from_partition_files(ticker: str, indicator_name: str):
     return all_indicators
 
 
-def save_indicators_to_file(indicator_values):
+def save_indicators_to_file(indicator_values: IndicatorCache):
+    '''Appends values calculated since the last save'''
 
-    if not os.path.exists(INDICATORS_FOLDER): 
-        os.mkdir(INDICATORS_FOLDER)
-
-    filename = os.path.join(INDICATORS_FOLDER, indicator_values.ticker + "_" + indicator_values.ind_name + "_values.dat")
-
-    with open(filename, "wb") as file:
-        pickle.dump(indicator_values, file=file)
+    indicator_values.save()
     return
 
 def save_indicators_to_parition_files(all_indicators_values: dict):
@@ -117,10 +376,8 @@ def save_indicators_to_parition_files(all_indicators_values: dict):
     if not os.path.exists(INDICATORS_FOLDER): 
         os.mkdir(INDICATORS_FOLDER)
 
-    for indicator_values in all_indicators_values.items():
-        filename = os.path.join(INDICATORS_FOLDER, indicator_values[1].ticker + "_" + indicator_values[1].ind_name + "_" + indicator_values[0] + "_values.dat")
-
-        with open(filename, "wb") as file:
-            pickle.dump(indicator_values[1], file=file)
+    #every partition keeps the folder it was loaded from (see load_indicators_from_file)
+    for indicator_values in all_indicators_values.values():
+        indicator_values.save()
     
     return
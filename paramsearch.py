@@ -0,0 +1,175 @@
+import math
+import random
+from itertools import product
+
+from utils import setup_logger
+from globals import HALVING_KEEP, HALVING_MIN_CANDIDATES, HALVING_MIN_CANDLES, HALVING_MIN_GROWTH
+from globals import TPE_STARTUP_RUNS, TPE_BATCH, TPE_GOOD_PART, TPE_CANDIDATES, TPE_SAMPLE_ATTEMPTS
+from globals import REFINE_COARSE_STEP, REFINE_TOP_K
+
+logger = setup_logger(__name__)
+
+#Search of the best strategy parameters without running every combination over the whole in-sample period.
+#Search functions don't run strategies by themselves, they get:
+#   evaluate(params_combinations, test_len) - runs strategy for every combination on last "test_len" candles (-1 - whole period)
+#                                             and returns list of reports
+#   score(report) - value to compare reports by (the bigger the better), see strategytester.score_report()
+
+'''
+Successive halving: all combinations are run on a short recent part of in-sample period, only top "keep" part of them (by score)
+is run again on a longer part, and so on. Combinations which are left ("min_candidates" or more) are run on the whole period,
+so their reports are the same as reports of the full grid search
+'''
+def successive_halving(all_params_combinations: list[tuple], evaluate, score, full_len: int, keep: float = HALVING_KEEP,
+                       min_candidates: int = HALVING_MIN_CANDIDATES, min_len: int = HALVING_MIN_CANDLES) -> list:
+
+    candidates = list(all_params_combinations)
+    rungs = halving_rungs(len(candidates), full_len, keep, min_candidates, min_len)
+    #when short periods are merged into one (min_len), the part which is kept is made smaller to still get down to min_candidates
+    keep = min(keep, (min_candidates/len(candidates))**(1/len(rungs))) if rungs else keep
+    for test_len in rungs:
+        reports = evaluate(candidates, test_len)
+        #sort is stable, so combinations with the same score keep order of the grid
+        reports.sort(reverse=True, key=score)
+        keep_num = max(min_candidates, math.ceil(len(reports)*keep))
+        candidates = [report.params for report in reports[:keep_num]]
+        logger.info(f"successive_halving(): {len(reports)} combinations run on {test_len} candles, {len(candidates)} left")
+
+    return evaluate(candidates, full_len)
+
+def halving_rungs(candidates_num: int, full_len: int, keep: float, min_candidates: int, min_len: int) -> list[int]:
+    '''Lengths of test periods (in candles) for every step of successive halving before the final run on "full_len" candles'''
+    if candidates_num <= min_candidates:
+        return []
+
+    rungs_num = math.ceil(math.log(candidates_num/min_candidates)/math.log(1/keep))
+    rungs = []
+    for i in range(rungs_num, 0, -1):
+        test_len = max(min_len, int(full_len * keep**i))
+        #a step on almost the same period as the step before it (or as the final run) would only repeat the ranking
+        if test_len*HALVING_MIN_GROWTH <= full_len and (not rungs or test_len >= rungs[-1]*HALVING_MIN_GROWTH):
+            rungs.append(test_len)
+    return rungs
+
+'''
+Tree-structured Parzen Estimator: "budget" combinations are run on the whole period. First TPE_STARTUP_RUNS of them are random,
+every next batch is sampled where good combinations (top TPE_GOOD_PART by score) are dense and the rest are rare.
+values - possible values of every parameter, is_valid(params) - filter of combinations (e.g. fast MA < slow MA).
+Same seed gives the same combinations
+'''
+def tpe_search(values: list[list[int]], evaluate, score, budget: int, seed: int = 1, is_valid = None) -> list:
+
+    rnd = random.Random(seed)
+    is_valid = is_valid if is_valid else lambda params: True
+    reports = []
+    tried = set()
+
+    while len(reports) < budget:
+        batch_size = min(TPE_BATCH, budget - len(reports))
+        if len(reports) < TPE_STARTUP_RUNS:
+            batch = _random_combinations(values, rnd, is_valid, tried, batch_size)
+        else:
+            batch = _tpe_combinations(values, rnd, is_valid, tried, batch_size, reports, score)
+        if not batch:
+            break       #all valid combinations are tried
+
+        tried.update(batch)
+        reports.extend(evaluate(batch, -1))
+        logger.info(f"tpe_search(): {len(reports)} of {budget} combinations done")
+
+    return reports
+
+def _random_combinations(values: list[list[int]], rnd: random.Random, is_valid, tried: set, num: int) -> list[tuple]:
+    '''Up to "num" random valid combinations which were not tried yet'''
+    batch = []
+    for _ in range(num*TPE_SAMPLE_ATTEMPTS):
+        params = tuple(rnd.choice(v) for v in values)
+        if params not in tried and params not in batch and is_valid(params):
+            batch.append(params)
+            if len(batch) == num:
+                break
+    return batch
+
+def _tpe_combinations(values: list[list[int]], rnd: random.Random, is_valid, tried: set, num: int, reports: list, score) -> list[tuple]:
+
+    ranked = sorted(reports, reverse=True, key=score)
+    good_num = max(1, int(len(ranked)*TPE_GOOD_PART))
+    good_density = [_parzen(v, [r.params[i] for r in ranked[:good_num]]) for i, v in enumerate(values)]
+    bad_density = [_parzen(v, [r.params[i] for r in ranked[good_num:]]) for i, v in enumerate(values)]
+    
+    batch = []
+    for _ in range(num):
+        #the best of TPE_CANDIDATES sampled from density of good combinations by ratio of good/bad densities
+        best_params, best_ratio = None, -math.inf
+        for _ in range(TPE_CANDIDATES):
+            indexes = [rnd.choices(range(len(v)), weights=density)[0] for v, density in zip(values, good_density)]
+            params = tuple(v[j] for v, j in zip(values, indexes))
+            if params in tried or params in batch or not is_valid(params):
+                continue
+            ratio = sum(math.log(good[j]/bad[j]) for good, bad, j in zip(good_density, bad_density, indexes))
+            if ratio > best_ratio:
+                best_params, best_ratio = params, ratio
+        
+        if best_params is None:
+            #good area is exhausted - try random combination
+            best_params = next(iter(_random_combinations(values, rnd, is_valid, tried.union(batch), 1)), None)
+            if best_params is None:
+                break
+        batch.append(best_params)
+    return batch
+
+def _parzen(values: list[int], observed: list[int]) -> list[float]:
+    '''Density over positions of "values": gaussian kernel around every observed value plus uniform prior'''
+    #kernel gets narrower as more combinations are observed
+    bandwidth = max(1.0, len(values)/(1 + len(observed)))
+    positions = [values.index(x) for x in observed]
+    density = [1.0/len(values) + sum(math.exp(-0.5*((j - p)/bandwidth)**2) for p in positions) for j in range(len(values))]
+    total = sum(density)
+    return [d/total for d in density]
+
+'''
+Coarse-to-fine grid: grid is run with "coarse" times bigger step of every parameter first. Then step is halved again and again 
+(down to the step from settings) and only neighbours of "top_k" best combinations (by score) are run on every step.
+Combinations which were run already are not run again. values - possible values of every parameter (with step from settings),
+grid_size - number of valid combinations of the full grid (to log runs saved), if not set the full grid is taken as valid
+'''
+def grid_refinement(values: list[list[int]], evaluate, score, is_valid = None, coarse: int = REFINE_COARSE_STEP, top_k: int = REFINE_TOP_K,
+                    grid_size: int = None) -> list:
+
+    is_valid = is_valid if is_valid else _all_valid
+    reports = {}        #indexes of parameters values -> report
+
+    def run(indexes_list: list[tuple]):
+        indexes_list = [ix for ix in dict.fromkeys(indexes_list) if ix not in reports and is_valid(_combination(values, ix))]
+        if indexes_list:
+            for ix, report in zip(indexes_list, evaluate([_combination(values, ix) for ix in indexes_list], -1)):
+                reports[ix] = report
+
+    run(list(product(*[range(0, len(v), coarse) for v in values])))
+    logger.info(f"grid_refinement(): {len(reports)} combinations run on coarse grid (step x{coarse})")
+
+    step = coarse
+    while step > 1:
+        step //= 2
+        best = sorted(reports, reverse=True, key=lambda ix: score(reports[ix]))[:top_k]
+        neighbours = []
+        for ix in best:
+            around = [[j for j in (i - step, i, i + step) if 0 <= j < len(v)] for i, v in zip(ix, values)]
+            neighbours.extend(product(*around))
+        run(neighbours)
+        logger.info(f"grid_refinement(): {len(reports)} combinations run after refinement with step x{step}")
+
+    if grid_size is None and is_valid is not _all_valid:
+        #size of the grid before is_valid filter is only an upper bound - runs saved are not known
+        logger.info(f"grid_refinement(): {len(reports)} combinations run, full grid has up to {math.prod(len(v) for v in values)} combinations")
+    else:
+        grid_size = grid_size if grid_size is not None else math.prod(len(v) for v in values)
+        logger.info(f"grid_refinement(): {len(reports)} combinations run, {grid_size - len(reports)} runs saved compared with the full grid of {grid_size}")
+
+    return list(reports.values())
+
+def _all_valid(params: tuple) -> bool:
+    return True
+
+def _combination(values: list[list[int]], indexes: tuple) -> tuple:
+    return tuple(v[i] for v, i in zip(values, indexes))
@@ -34,6 +34,14 @@ class StrategySettings:
         self.day_end_utc: datetime = time(int(settings['tester']['day_end_utc']), 0, 0, tzinfo=timezone.utc)
         self.spread = float(settings['tester']['spread'])
         self.strategy_log = settings['tester']['strategy_log']
+        self.strategy_log_top = int(settings['tester'].get('strategy_log_top', 1))
+        self.sweep_workers = int(settings['tester'].get('sweep_workers', 1))
+        self.backtest_engine = settings['tester'].get('backtest_engine', 'bar')
+        self.param_search = settings['tester'].get('param_search', 'grid')
+        self.search_budget = int(settings['tester'].get('search_budget', 200))
+        self.search_seed = int(settings['tester'].get('search_seed', 1))
+        self.abort_max_drawdown = float(settings['tester'].get('abort_max_drawdown', 0))
+        self.abort_min_orders = settings['tester'].get('abort_min_orders', False)
 
         self.skip_holidays = settings['tuning']['skip_holidays']
         self.skip_morning_hours = settings['tuning']['skip_morning_hours']
@@ -72,6 +80,10 @@ class StrategySettings:
 
         logger.info(f"    Strategy start capital: {self.start_capital}")
         logger.info(f"    Market spread % (manual, or take from market when 0): {self.spread}")
+        logger.info(f"    Parameter sweep workers (0 - all CPU cores): {self.sweep_workers}")
+        logger.info(f"    Backtest engine: {self.backtest_engine}")
+        logger.info(f"    Parameters search: {self.param_search} (budget for tpe: {self.search_budget}, seed: {self.search_seed})")
+        logger.info(f"    Abort run on drawdown %: {self.abort_max_drawdown}, on too few orders: {self.abort_min_orders}")
 
         logger.info(f"    Skip Holidays: {self.skip_holidays}")
         logger.info(f"    Skip Morning Hours: {self.skip_morning_hours}")
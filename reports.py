@@ -1,19 +1,24 @@
 import os
+import itertools
 import numpy as np
-from datetime import datetime, timedelta
+from functools import lru_cache
+from datetime import datetime, timedelta, date
 from schemas import Order
 from utils import setup_logger, get_param
 from globals import OrderChangeReason, StrategyCommand, OrderStatus, PerformedAction
-from globals import STATS_FOLDER, STRAT_CMD_STR, ORD_CHNG_REASON_STR, PERF_ACTION_STR, WORK_DAYS_RATE
+from globals import STATS_FOLDER, STRAT_CMD_STR, ORD_CHNG_REASON_STR, PERF_ACTION_STR, WORK_DAYS_RATE, ROBUST_RADIUS, CALENDAR_INDEX_CACHE_SIZE
 from candles import Tick
 
 logger = setup_logger(__name__)
 
 class StratLog1Tick:
+    __slots__ = ("candle", "indicators", "params", "strat_ord", "sl", "tp", "reason", "action")
+
+    #indicators and params are not copied: they are not changed after strategy returned them
     def __init__(self, candle: Tick, indicators: list[float], params: list[int], strat_ord: StrategyCommand, reason: OrderChangeReason, sl: float, tp: float, action: PerformedAction):
         self.candle: Tick = candle
-        self.indicators: list[float] = indicators[:]
-        self.params: list[int] = params[:]
+        self.indicators: list[float] = indicators
+        self.params: list[int] = params
         self.strat_ord: StrategyCommand = strat_ord
         self.sl = sl
         self.tp = tp
@@ -54,6 +59,29 @@ class StrategyLog:
         return
 
 
+class CalendarIndex:
+    '''All calendar days of a test period (first and last days are included). Daily returns and equities of reports are arrays
+       with one value per day of it'''
+    def __init__(self, first_day: date, last_day: date):
+        self.first_day = first_day
+        self.days_num = (last_day - first_day).days + 1
+
+    def dates(self) -> list[date]:
+        return [self.first_day + timedelta(days=i) for i in range(self.days_num)]
+
+    def day_numbers(self, times: list[datetime]) -> np.ndarray:
+        '''Number of the day of every time (0 - first day)'''
+        return np.fromiter(((t.date() - self.first_day).days for t in times), dtype=np.int64, count=len(times))
+
+@lru_cache(maxsize=CALENDAR_INDEX_CACHE_SIZE)
+def _calendar_index(first_day: date, last_day: date) -> CalendarIndex:
+    return CalendarIndex(first_day, last_day)
+
+def get_calendar_index(start_date: datetime, end_date: datetime) -> CalendarIndex:
+    '''Calendar index is made once for all reports of the sweep which have the same test period
+       (only last used periods are kept: pruned runs end on different days)'''
+    return _calendar_index(start_date.date(), end_date.date())
+
 class SingleRunStrategyReport:
 
     def __init__(self, orders_hist, params, start_capital, strategy_log: StrategyLog, start_date: datetime, end_date: datetime):
@@ -70,9 +98,10 @@ class SingleRunStrategyReport:
         self.end_capital = 0
 
         self.orders_history: list[Order] = orders_hist #all closed order after strategy run on fixed set of parameters was done
-        self.returns: dict = {}
-        self.equities: list[float]
-        self.__make_empty_returns()
+        self.calendar: CalendarIndex = get_calendar_index(start_date, end_date)
+        self.returns: np.ndarray = None #strategy return of every day of the calendar (calculate_Sharpe)
+        self.equities: np.ndarray = None #capital at the end of every day of the calendar (calcuate_max_drawdown)
+        self.__close_days: np.ndarray = None #day of the calendar when every order was closed
         self.params = params #fixed list of parameters used to run the strategy
         self.strategy_log: StrategyLog = strategy_log
 
@@ -83,18 +112,22 @@ class SingleRunStrategyReport:
         self.profit_factor = 0.0
         self.maxDD = 0.0
 
-    def __make_empty_returns(self):
-        self.returns.clear()
-        current = self.start_date
-        while current <= self.end_date:
-            self.returns[current.date()] = 0.0
-            current += timedelta(days=1)
-        self.returns[self.end_date.date()] = 0.0
-        return
+        self.pruned = False #run was stopped by abort rules before the last candle
+        self.bars_saved = 0 #candles which were not run because of that
+        self.test_len = 0 #candles the strategy was tested on (including candles not run because of abort rules), 0 - not known
+
+    def __daily_sums(self, values: np.ndarray) -> np.ndarray:
+        '''Sums of values of orders by days they were closed on (0 for days without orders)'''
+        if self.__close_days is None:
+            self.__close_days = self.calendar.day_numbers([i.c_time for i in self.orders_history])
+        return np.bincount(self.__close_days, weights=values, minlength=self.calendar.days_num)
+
+    def __orders_values(self, value) -> np.ndarray:
+        return np.fromiter((value(i) for i in self.orders_history), dtype=float, count=len(self.orders_history))
     
     def print_kpis(self):
-        #for key, value in self.returns.items():
-        #    logger.info(f"{key} : {value}")
+        #for day, value in zip(self.calendar.dates(), self.returns):
+        #    logger.info(f"{day} : {value}")
 
         logger.info(f"CAGR: {self.CAGR}")
         logger.info(f"Sharpe: {self.Sharpe}")
@@ -116,7 +149,8 @@ class SingleRunStrategyReport:
     
     def calcuate_CAGR(self, startdate, enddate):
         y = (enddate - startdate).days/365
-        self.CAGR = ((self.end_capital/self.start_capital) ** (1/y)) - 1        
+        #short test periods (parameters search) may be less than a day
+        self.CAGR = ((self.end_capital/self.start_capital) ** (1/y)) - 1 if y > 0 else 0.0
         return
 
     #Sharpe values
@@ -131,15 +165,12 @@ class SingleRunStrategyReport:
         risk_free_rate = 0
         periods_per_year = 365/WORK_DAYS_RATE
         #fill in strategy returns for every single day
-        self.__make_empty_returns()
-        for i in self.orders_history:
-            #TODO: I need to divide i.profit to current captial here, not open price value
-            self.returns[i.c_time.date()] =self.returns[i.c_time.date()] + i.profit/(i.o_price*i.lots)
+        #TODO: I need to divide i.profit to current captial here, not open price value
+        self.returns = self.__daily_sums(self.__orders_values(lambda i: i.profit/(i.o_price*i.lots)))
 
         #calculate average daily return and standard deveiation of daily returns
-        self.mean_return = sum(self.returns.values())/len(self.returns)
-        profits = np.array(list(self.returns.values()))
-        self.std_return = np.std(profits, ddof=1)
+        self.mean_return = np.mean(self.returns)
+        self.std_return = np.std(self.returns, ddof=1)
 
         excess_return = self.mean_return - (risk_free_rate / periods_per_year)
         self.Sharpe = (excess_return / self.std_return) * np.sqrt(periods_per_year)
@@ -148,43 +179,27 @@ class SingleRunStrategyReport:
 
     def calculate_Profit_Factor(self):
 
-        sum_profit = sum([p.profit for p in self.orders_history if p.profit > 0])
-        sum_loss = sum([p.profit for p in self.orders_history if p.profit < 0])
-        self.profit_factor = sum_profit/abs(sum_loss)
+        profits = self.__orders_values(lambda i: i.profit)
+        sum_profit = np.sum(profits[profits > 0])
+        sum_loss = np.sum(profits[profits < 0])
+        #no loss orders (may happen on short test periods)
+        self.profit_factor = sum_profit/abs(sum_loss) if sum_loss < 0 else (float("inf") if sum_profit > 0 else 0.0)
 
         return
 
     def calcuate_max_drawdown(self):
 
-        #create date:capital based dict
-        equities_dict = {}
-        current = self.start_date
-        while current <= self.end_date:
-            equities_dict[current.date()] = 0.0
-            current += timedelta(days=1)
-        equities_dict[self.end_date.date()] = 0.0
-
-        #fill dict with profits per days
-        for i in self.orders_history:
-            equities_dict[i.c_time.date()] = equities_dict[i.c_time.date()] + i.profit
+        #profits per days
+        equities = self.__daily_sums(self.__orders_values(lambda i: i.profit))
 
-        #get all daily profits(or loses) to list
-        equities = list(equities_dict.values())
-        
         #now convert it to equities at the end of each day
         equities[0] = self.start_capital + equities[0]
-        for i in range(1, len(equities)):
-            equities[i] = equities[i-1] + equities[i]
-
-        peaks = [0]*len(equities)
-        for i in range(0, len(equities)):
-            peaks[i] = max(equities[0:i+1])
+        self.equities = np.cumsum(equities)
 
-        drawdowns = [0]*len(equities)
-        for i in range(0, len(equities)):
-            drawdowns[i] = (equities[i] - peaks[i])/peaks[i]
+        peaks = np.maximum.accumulate(self.equities)
+        drawdowns = (self.equities - peaks)/peaks
 
-        self.maxDD = abs(min(drawdowns))
+        self.maxDD = float(abs(np.min(drawdowns)))
         return
 
     def print_report(self):
@@ -214,3 +229,101 @@ class SingleRunStrategyReport:
 
         file_report.close()
         return
+
+'''
+KPIs of all parameters combinations of the sweep as N-dimensional arrays with one axis per parameter from settings.params
+(position on the axis is the number of the value in range(min, max, step)). Cells of combinations which were not run are NaN
+'''
+class ResultsCube:
+    KPIS = ("profitability", "num_orders", "Sharpe", "profit_factor", "maxDD")
+
+    def __init__(self, params_settings: list):
+        self.names = [p[0] for p in params_settings]
+        self.axes = [range(p[1], p[2], p[3]) for p in params_settings]
+        shape = tuple(len(axis) for axis in self.axes)
+        self.kpis: dict[str, np.ndarray] = {name: np.full(shape, np.nan) for name in self.KPIS}
+        self.pruned = np.zeros(shape, dtype=bool)
+
+    def add(self, report: "SingleRunStrategyReport"):
+        index = tuple(axis.index(value) for axis, value in zip(self.axes, report.params))
+        for name in self.KPIS:
+            self.kpis[name][index] = getattr(report, name)
+        self.pruned[index] = report.pruned
+
+    def params(self, index: tuple) -> tuple:
+        return tuple(axis[i] for axis, i in zip(self.axes, index))
+
+    def neighbourhood_mean(self, kpi: str = "profitability", radius: int = ROBUST_RADIUS) -> np.ndarray:
+        '''Mean of kpi over box of (2*radius+1) cells along every axis around every cell. Cells which were not run are skipped'''
+        values = self.kpis[kpi]
+        was_run = ~np.isnan(values)
+        sums = _box_sum(np.where(was_run, values, 0.0), radius)
+        counts = _box_sum(was_run.astype(float), radius)
+        return np.divide(sums, counts, out=np.full(values.shape, np.nan), where=counts > 0)
+
+    def best_robust(self, min_orders: int, radius: int = ROBUST_RADIUS):
+        '''Params with the best mean profitability of neighbourhood among combinations with at least "min_orders" orders 
+           and not stopped by abort rules, and that mean. None if there are no such combinations'''
+        allowed = (self.kpis["num_orders"] >= min_orders) & ~self.pruned
+        if not allowed.any():
+            return None
+        score = np.where(allowed, self.neighbourhood_mean("profitability", radius), -np.inf)
+        #the first of equal cells in order of the grid
+        index = np.unravel_index(np.argmax(score), score.shape)
+        return self.params(index), float(score[index])
+
+    def save(self, rep_dir: str):
+        np.savez(os.path.join(rep_dir, "results_cube.npz"), pruned=self.pruned, **self.kpis,
+                 **{"axis_" + name: np.array(axis) for name, axis in zip(self.names, self.axes)})
+
+'''
+Results cube of sampled searches (tpe): only visited cells are kept, so memory does not depend on the size of the grid. 
+Neighbourhood means and best_robust() are the same as for ResultsCube, but only for visited cells
+'''
+class SparseResultsCube(ResultsCube):
+
+    def __init__(self, params_settings: list):
+        self.names = [p[0] for p in params_settings]
+        self.axes = [range(p[1], p[2], p[3]) for p in params_settings]
+        self.cells: dict[tuple, dict[str, float]] = {}
+        self.pruned: dict[tuple, bool] = {}
+
+    def add(self, report: "SingleRunStrategyReport"):
+        index = tuple(axis.index(value) for axis, value in zip(self.axes, report.params))
+        self.cells[index] = {name: getattr(report, name) for name in self.KPIS}
+        self.pruned[index] = report.pruned
+
+    def neighbourhood_mean(self, kpi: str = "profitability", radius: int = ROBUST_RADIUS) -> dict[tuple, float]:
+        '''Mean of kpi over visited cells in box of (2*radius+1) cells along every axis around every visited cell'''
+        offsets = list(itertools.product(range(-radius, radius + 1), repeat=len(self.axes)))
+        means = {}
+        for index in self.cells:
+            neighbours = (self.cells.get(tuple(i + k for i, k in zip(index, offset))) for offset in offsets)
+            values = [cell[kpi] for cell in neighbours if cell is not None and not np.isnan(cell[kpi])]
+            means[index] = sum(values) / len(values) if values else np.nan
+        return means
+
+    def best_robust(self, min_orders: int, radius: int = ROBUST_RADIUS):
+        allowed = [index for index in sorted(self.cells) if self.cells[index]["num_orders"] >= min_orders and not self.pruned[index]]
+        if not allowed:
+            return None
+        means = self.neighbourhood_mean("profitability", radius)
+        #the first of equal cells in order of the grid
+        index = max(allowed, key=means.get)
+        return self.params(index), float(means[index])
+
+    def save(self, rep_dir: str):
+        #"index" - indexes of visited cells along every axis, kpis are given for these cells in the same order
+        indexes = sorted(self.cells)
+        np.savez(os.path.join(rep_dir, "results_cube.npz"), index=np.array(indexes, dtype=int).reshape(len(indexes), len(self.axes)),
+                 pruned=np.array([self.pruned[index] for index in indexes], dtype=bool),
+                 **{name: np.array([self.cells[index][name] for index in indexes], dtype=float) for name in self.KPIS},
+                 **{"axis_" + name: np.array(axis) for name, axis in zip(self.names, self.axes)})
+
+def _box_sum(values: np.ndarray, radius: int) -> np.ndarray:
+    '''Convolution with box kernel of (2*radius+1) cells along every axis (cells outside of array are 0)'''
+    for axis in range(values.ndim):
+        n = values.shape[axis]
+        padded = np.pad(values, [(radius, radius) if i == axis else (0, 0) for i in range(values.ndim)])
+        values = sum(padded[(slice(None),)*axis + (slice(k, k + n),)] for k in range(2*radius + 1))
+    return values
@@ -9,6 +9,27 @@ from utils import setup_logger
 
 logger = setup_logger(__name__)
 
+class TradeRecord:
+    '''Closed order as it is kept in strategy tester reports. Has the same fields as Order which reports use'''
+    __slots__ = ("direction", "lots", "o_price", "c_price", "o_time", "c_time", "reason", "params", "profit", "profit_percent")
+
+    def __init__(self, order: "Order"):
+        self.direction: OrderDir = order.direction
+        self.lots: int = order.lots
+        self.o_price: float = order.o_price
+        self.c_price: float = order.c_price
+        self.o_time: datetime = order.o_time
+        self.c_time: datetime = order.c_time
+        self.reason: OrderChangeReason = order.reason
+        self.params = order.params      #not copied: it is replaced (not changed) when order is opened again
+        self.profit: float = order.profit
+        self.profit_percent: float = order.profit_percent
+
+class TradeLedger(list):
+    '''List of TradeRecord of one strategy tester run. Order.close() adds records to it instead of deep copies of the order'''
+    def add(self, order: "Order"):
+        self.append(TradeRecord(order))
+
 class Order:
     def __init__(self, direction: OrderDir, lots, price, time, status = OrderStatus.OPEN, sl=-1, tp=-1):
         self.direction: OrderDir = direction
@@ -62,7 +83,11 @@ class Order:
             self.profit -= 2*self.lots*spread
             self.profit_percent = round(100*self.profit/(self.lots*self.o_price), 2)
         
-            report.append(copy.deepcopy(self))
+            if isinstance(report, TradeLedger):
+                #strategy tester: compact record instead of a copy of the whole order
+                report.add(self)
+            else:
+                report.append(copy.deepcopy(self))
 
             #only when calling from trade_bot (when calling from strategy_tester, ticker must be "")
             if ticker != "":
@@ -107,13 +132,17 @@ class Order:
                     SL: {self.sl} TP: {self.tp} Reason: {ORD_CHNG_REASON_STR[self.reason]}")
         
 
+#one response is still allocated per bar by each strategy; slots keep it small and cheap to create
 class StrategyResp: 
-    def __init__(self, cmd: StrategyCommand, reason: OrderChangeReason = OrderChangeReason.UNSPECIFIED, sl: float=-1, tp: float=-1, lots: int = 1, ind_val: list[float] = [-1,-1,-1,-1], trend: Trend = Trend.UNSPECIFIED):
+    __slots__ = ("cmd", "trend", "tp", "sl", "lots", "reason", "indicator_values")
+
+    #ind_val is kept without copy (strategies pass a new list every time and nobody changes it after)
+    def __init__(self, cmd: StrategyCommand, reason: OrderChangeReason = OrderChangeReason.UNSPECIFIED, sl: float=-1, tp: float=-1, lots: int = 1, ind_val: list[float] = (-1,-1,-1,-1), trend: Trend = Trend.UNSPECIFIED):
         self.cmd: StrategyCommand = cmd
         self.trend: Trend = trend
         self.tp: float = tp
         self.sl: float = sl
         self.lots = lots
         self.reason: OrderChangeReason = reason
-        self.indicator_values = ind_val[:]
+        self.indicator_values = ind_val
         return
@@ -1,15 +1,15 @@
 ﻿import random
-import operator
 import os
 import csv
 from datetime import datetime
 from pathlib import Path
 
 from indicators import Indicators
-from indicatorvals import IndicatorValues, IndicatorAttr, IndicatorAttrSimple, IndicatorValuesSimple, IndicatorAttrMACD, IndicatorValuesMACD, load_indicators_from_file
-from candles import Tick
+from indicatorvals import IndicatorCache, load_indicators_from_file
+from candles import Tick, get_column, get_day_index
 from strategydata import Instr
 from utils import setup_logger
+import globals as gl
 from globals import STRAT_ORDERS_FOLDER, MAX_PARAM0, MAX_PARAM1, STRAT_CMD_STR
 from globals import OrderChangeReason, StrategyCommand
 from schemas import StrategyResp
@@ -30,7 +30,7 @@ class StrategyLog:
         self.order = order
         self.time = candles[-1].Time
         ma_slow_param = params[1]
-        self.close_values = list(map(operator.attrgetter('Close'), candles[-ma_slow_param:])).copy()
+        self.close_values = get_column(candles, 'Close', -ma_slow_param)
 
     def save_strategy_orders(self):
         logger.debug(f"Strategy: Order : {STRAT_CMD_STR[self.order]}")
@@ -83,11 +83,11 @@ def strategy_MA_cross_price_deviation(data: Tick, params, instrument: Instr = No
 
     trade_allowed = can_I_trade(data, price_deviation_limit, calm_days_to_stop)
 
-    ma_fast = Indicators.sma(list(map(operator.attrgetter('Close'), data[-ma_fast_param:])), ma_fast_param)
-    ma_slow = Indicators.sma(list(map(operator.attrgetter('Close'), data[-ma_slow_param:])), ma_slow_param)
+    ma_fast = Indicators.sma(get_column(data, 'Close', -ma_fast_param), ma_fast_param)
+    ma_slow = Indicators.sma(get_column(data, 'Close', -ma_slow_param), ma_slow_param)
 
-    ma_fast_prev = Indicators.sma(list(map(operator.attrgetter('Close'), data[-ma_fast_param-1:-1])), ma_fast_param)
-    ma_slow_prev = Indicators.sma(list(map(operator.attrgetter('Close'), data[-ma_slow_param-1:-1])), ma_slow_param)
+    ma_fast_prev = Indicators.sma(get_column(data, 'Close', -ma_fast_param-1, -1), ma_fast_param)
+    ma_slow_prev = Indicators.sma(get_column(data, 'Close', -ma_slow_param-1, -1), ma_slow_param)
 
     supposed = StrategyCommand.UNSPECIFIED
 
@@ -271,40 +271,52 @@ def get_alligator(data:Tick, params):
 
 def get_SMA(data: Tick, param: int, instrument: Instr = None) -> float:
     
+    #values pre-calculated once for the whole sweep
+    if gl.SMA_INDICATORS_MATRIX:
+        sma = gl.SMA_INDICATORS_MATRIX.get_sma(data[-1].Time, param)
+        if sma != -1:
+            return sma
+
     if instrument and instrument.use_precalculated_indicators:
         #try to get pre-calculated values of SMA.
-        indicators: IndicatorValuesSimple = instrument.indicators.get("SMA", None)
+        indicators: IndicatorCache = instrument.indicators.get("SMA", None)
         if not indicators: 
             indicators = load_indicators_from_file(instrument.ticker, "SMA")
             instrument.indicators["SMA"] = indicators
         
         #If it is not yet calculated - then calculate and store
-        sma = indicators.values.get(IndicatorAttrSimple(data[-1].Time, param), -1)
+        sma = indicators.get(data[-1].Time, param)
         if sma == -1:
-            sma = Indicators.sma(list(map(operator.attrgetter('Close'), data[-param:])), param)
-            indicators.values |= {IndicatorAttrSimple(data[-1].Time, param) : sma}
+            sma = Indicators.sma(get_column(data, 'Close', -param), param)
+            indicators.put(data[-1].Time, sma, param)
             instrument.indicators_were_updated = True
     else:
-        sma = Indicators.sma(list(map(operator.attrgetter('Close'), data[-param:])), param)
+        sma = Indicators.sma(get_column(data, 'Close', -param), param)
 
     return sma
 
 def get_EMA(data: list[Tick], param: int, instrument: Instr = None) -> float:
     
+    #values pre-calculated once for the whole sweep
+    if gl.SMA_INDICATORS_MATRIX:
+        ema = gl.SMA_INDICATORS_MATRIX.get_ema(data[-1].Time, param)
+        if ema != -1:
+            return ema
+
     if instrument.use_precalculated_indicators:
         #try to get pre-calculated values of EMA.
-        indicators: IndicatorValues = instrument.indicators.get("EMA", None)
+        indicators: IndicatorCache = instrument.indicators.get("EMA", None)
         if not indicators: 
             indicators = load_indicators_from_file(instrument.ticker, "EMA")
             instrument.indicators["EMA"] = indicators
         #If it is not yet calculated - then calculate and store
-        ema = indicators.values.get(IndicatorAttr(data[-1].Time, param), [-1,-1,-1,-1])[0]
+        ema = indicators.get(data[-1].Time, param)
         if ema == -1:
-            ema = Indicators.ema(list(map(operator.attrgetter('Close'), data[-2*param:])), param)
-            indicators.values |= {IndicatorAttr(data[-1].Time, param) : [ema, -1, -1, -1]}
+            ema = Indicators.ema(get_column(data, 'Close', -2*param), param)
+            indicators.put(data[-1].Time, ema, param)
             instrument.indicators_were_updated = True
     else:
-        ema = Indicators.ema(list(map(operator.attrgetter('Close'), data[-2*param:])), param)
+        ema = Indicators.ema(get_column(data, 'Close', -2*param), param)
 
     return ema
 
@@ -314,25 +326,31 @@ def get_MACD(data: list[Tick], params: list[int], instrument: Instr = None):
     slow = params[1]
     signal = params[2]
     needed_len = 2*(slow + signal)
+
+    #values pre-calculated once for the whole sweep
+    if gl.SMA_INDICATORS_MATRIX:
+        m_val, s_val = gl.SMA_INDICATORS_MATRIX.get_macd(data[-1].Time, fast, slow, signal)
+        if m_val != -1:
+            return m_val, s_val, m_val-s_val
     
     if instrument.use_precalculated_indicators:
         #try to get pre-calculated values of MACD.
-        indicators: IndicatorValuesMACD = instrument.indicators.get("MACD", None)
+        indicators: IndicatorCache = instrument.indicators.get("MACD", None)
         if not indicators: 
             indicators = load_indicators_from_file(instrument.ticker, "MACD")
             instrument.indicators["MACD"] = indicators
 
         #If it is not yet calculated - then calculate and store
-        macd_vals = indicators.values.get(IndicatorAttrMACD(data[-1].Time, p1=fast, p2=slow, p3=signal), [-1,-1])
+        macd_vals = indicators.get(data[-1].Time, fast, slow, signal, default=(-1,-1))
         if macd_vals[0] == -1:
-            m_val, s_val, _ = Indicators.macd(list(map(operator.attrgetter('Close'), data[-needed_len:])), fast, slow, signal)
-            indicators.values |= {IndicatorAttrMACD(data[-1].Time, p1=fast, p2=slow, p3=signal) : [m_val, s_val]}
+            m_val, s_val, _ = Indicators.macd(get_column(data, 'Close', -needed_len), fast, slow, signal)
+            indicators.put(data[-1].Time, (m_val, s_val), fast, slow, signal)
             instrument.indicators_were_updated = True
         else:
             m_val = macd_vals[0]
             s_val = macd_vals[1]
     else:
-        m_val, s_val, _ = Indicators.macd(list(map(operator.attrgetter('Close'), data[-needed_len:])), fast, slow, signal)
+        m_val, s_val, _ = Indicators.macd(get_column(data, 'Close', -needed_len), fast, slow, signal)
 
     return m_val, s_val, m_val-s_val
 
@@ -340,18 +358,18 @@ def get_RSI(data: list[Tick], period: int, instrument: Instr = None) -> float:
 
     if instrument.use_precalculated_indicators:
         #try to get pre-calculated values of RSI.
-        indicators: IndicatorValuesSimple = instrument.indicators.get("RSI", None)
+        indicators: IndicatorCache = instrument.indicators.get("RSI", None)
         if not indicators: 
             indicators = load_indicators_from_file(instrument.ticker, "RSI")
             instrument.indicators["RSI"] = indicators
         #If it is not yet calculated - then calculate and store
-        rsi = indicators.values.get(IndicatorAttrSimple(data[-1].Time, period), -1)
+        rsi = indicators.get(data[-1].Time, period)
         if rsi == -1:
-            rsi = Indicators.rsi(list(map(operator.attrgetter('Close'), data[-period-1:])), period)
-            indicators.values |= {IndicatorAttrSimple(data[-1].Time, period) : rsi}
+            rsi = Indicators.rsi(get_column(data, 'Close', -period-1), period)
+            indicators.put(data[-1].Time, rsi, period)
             instrument.indicators_were_updated = True
     else:
-        rsi = Indicators.rsi(list(map(operator.attrgetter('Close'), data[-period-1:])), period)
+        rsi = Indicators.rsi(get_column(data, 'Close', -period-1), period)
 
     return rsi
 
@@ -359,15 +377,15 @@ def get_ATR(data: list[Tick], period: int, instrument: Instr = None) -> float:
 
     if instrument and instrument.use_precalculated_indicators:
         #try to get pre-calculated values of ATR.
-        indicators: IndicatorValuesSimple = instrument.indicators.get("ATR", None)
+        indicators: IndicatorCache = instrument.indicators.get("ATR", None)
         if not indicators: 
             indicators = load_indicators_from_file(instrument.ticker, "ATR")
             instrument.indicators["ATR"] = indicators
         #If it is not yet calculated - then calculate and store
-        atr = indicators.values.get(IndicatorAttrSimple(data[-1].Time, period), -1)
+        atr = indicators.get(data[-1].Time, period)
         if atr == -1:
             atr = Indicators.atr(data, period)
-            indicators.values |= {IndicatorAttrSimple(data[-1].Time, period) : atr}
+            indicators.put(data[-1].Time, atr, period)
             instrument.indicators_were_updated = True
     else:
         atr = Indicators.atr(data, period)
@@ -379,10 +397,26 @@ def get_Stochastic(data: list[Tick], params: list[int], instrument: Instr = None
     k_period, d_period, smooth = params
     needed_len = k_period + d_period - 1
 
-    rsi = Indicators.stochastic(list(map(operator.attrgetter('Close'), data[-needed_len:])), [k_period, d_period, smooth])
+    #values pre-calculated once for the whole sweep
+    if gl.SMA_INDICATORS_MATRIX:
+        percent_k, percent_d = gl.SMA_INDICATORS_MATRIX.get_stochastic(data[-1].Time, k_period, d_period, smooth)
+        if percent_k != -1:
+            return percent_k, percent_d
+
+    rsi = Indicators.stochastic(get_column(data, 'Close', -needed_len), [k_period, d_period, smooth])
 
     return rsi
 
+def get_Bollinger(data: list[Tick], period: int, instrument: Instr = None) -> tuple:
+
+    #values pre-calculated once for the whole sweep
+    if gl.SMA_INDICATORS_MATRIX:
+        bands = gl.SMA_INDICATORS_MATRIX.get_bollinger(data[-1].Time, period)
+        if bands[0] != -1:
+            return bands
+
+    return Indicators.boilinger(get_column(data, 'Close', -2*period), period)
+
 def get_dailypoints(data: list[Tick]) -> tuple:
     
     r1, s1, r2, s2 = Indicators.dailypivotpoints(data)
@@ -391,46 +425,47 @@ def get_dailypoints(data: list[Tick]) -> tuple:
 
 def get_ADX(data: list[Tick], period: int, instrument: Instr = None) -> float:
 
+    #values pre-calculated once for the whole sweep
+    if gl.SMA_INDICATORS_MATRIX:
+        adx, di_plus, di_minus = gl.SMA_INDICATORS_MATRIX.get_adx(data[-1].Time, period)
+        if adx != -1:
+            return adx, di_plus, di_minus
+
     if instrument.use_precalculated_indicators:
         #try to get pre-calculated values of ADX.
-        indicators: IndicatorValues = instrument.indicators.get("ADX", None)
+        indicators: IndicatorCache = instrument.indicators.get("ADX", None)
         if not indicators: 
             indicators = load_indicators_from_file(instrument.ticker, "ADX")
             instrument.indicators["ADX"] = indicators
         #If it is not yet calculated - then calculate and store
-        adx_vals = indicators.values.get(IndicatorAttr(data[-1].Time, period), [-1,-1,-1,-1])
+        adx_vals = indicators.get(data[-1].Time, period, default=(-1,-1,-1))
         if adx_vals[0] == -1:
-            adx, di_plus, di_minus = Indicators.adx(low=list(map(operator.attrgetter('Low'), data[-4*(period+1):])),
-                                                    high=list(map(operator.attrgetter('High'), data[-4*(period+1):])),
-                                                    close=list(map(operator.attrgetter('Close'), data[-4*(period+1):])),
+            adx, di_plus, di_minus = Indicators.adx(low=get_column(data, 'Low', -4*(period+1)),
+                                                    high=get_column(data, 'High', -4*(period+1)),
+                                                    close=get_column(data, 'Close', -4*(period+1)),
                                                     period=period)
 
-            indicators.values |= {IndicatorAttr(data[-1].Time, period) : [adx, di_plus, di_minus, -1]}
+            indicators.put(data[-1].Time, (adx, di_plus, di_minus), period)
             instrument.indicators_were_updated = True
         else:
             adx = adx_vals[0]
             di_plus = adx_vals[1]
             di_minus = adx_vals[2]
     else:
-        adx, di_plus, di_minus = Indicators.adx(low=list(map(operator.attrgetter('Low'), data[-4*(period+1):])),
-                                                high=list(map(operator.attrgetter('High'), data[-4*(period+1):])),
-                                                close=list(map(operator.attrgetter('Close'), data[-4*(period+1):])),
+        adx, di_plus, di_minus = Indicators.adx(low=get_column(data, 'Low', -4*(period+1)),
+                                                high=get_column(data, 'High', -4*(period+1)),
+                                                close=get_column(data, 'Close', -4*(period+1)),
                                                 period=period)
 
 
     return adx, di_plus, di_minus
 
 # 'min day price' to 'max day price' delta in percent, during last day of provided data set
+#(close of the last candle of the previous day is taken into account as well)
 def last_day_price_deviation(data: Tick) -> float:
     
-    day_value = int(data[-1].Time.day)
-    min_price = 9999999
-    max_price = -1
-    for i in range(len(data)-1, -1, -1):
-        min_price = data[i].Close if data[i].Close < min_price else min_price
-        max_price = data[i].Close if data[i].Close > max_price else max_price
-        if day_value != int(data[i].Time.day):
-            break
+    day_index, start, end = get_day_index(data)
+    min_price, max_price = day_index.last_day_close_range(start, end)
     
     return 100*(max_price-min_price)/min_price
 
@@ -438,20 +473,15 @@ def last_day_price_deviation(data: Tick) -> float:
 def avg_price_deviation(data: Tick, days: int) -> float:
 
     deviations = []
-    deviations.clear()
 
-    day_value = int(data[-1].Time.day)
+    day_index, start, end = get_day_index(data)
+    day = day_index.day_of_bar[end-1]
     deviations.append(last_day_price_deviation(data))
-    day_count = 1
-    for i in range(len(data)-1, -1, -1):
-        
-        if day_count >= days:
-            break
-        
-        if day_value != int(data[i].Time.day):
-            deviations.append(last_day_price_deviation(data[0:i+1]))
-            day_value = int(data[i].Time.day)
-            day_count += 1
+    #previous days of data, each one till its last candle
+    while len(deviations) < days and day_index.day_start[day] > start:
+        day -= 1
+        min_price, max_price = day_index.last_day_close_range(start, day_index.day_end[day])
+        deviations.append(100*(max_price-min_price)/min_price)
 
     return sum(deviations)/len(deviations)
 
@@ -4,12 +4,13 @@ import os
 import csv
 from datetime import datetime
 from pathlib import Path
+import numpy as np
 
 from indicators import Indicators
-from indicatorvals import IndicatorValues, IndicatorAttr, IndicatorAttrSimple, IndicatorValuesSimple, IndicatorAttrMACD, IndicatorValuesMACD, load_indicators_from_file
-from candles import Tick
+from indicatorvals import load_indicators_from_file
+from candles import Tick, CandleWindow, get_day_index, get_swing_index
 from strategydata import Instr
-from utils import setup_logger, candles_until_end_of_day
+from utils import setup_logger
 from globals import STRAT_ORDERS_FOLDER, MAX_PARAM0, MAX_PARAM1, ORDER_DIR_STR, TREND_STR
 from globals import OrderChangeReason, StrategyCommand, OrderStatus, PerformedAction, Trend
 from strategies import get_SMA, get_EMA, get_alligator, get_MACD, get_ADX, get_RSI, get_Stochastic, get_ATR, get_dailypoints
@@ -624,37 +625,43 @@ def trail_stops(candle: Tick, new_sl: float, current_order: Order) -> bool:
             b_updated = True
     return b_updated
 
+#latest Low which is the lowest of 5 candles around it. Swing points are found once per candles series (see SwingIndex)
 def find_prev_swing_low(candles: list[Tick]) -> float:
 
-    swing_low = candles[-1].Low
-    for i in range(-3, -len(candles)+2, -1):
-        if candles[i].Low == min(candles[i-2].Low, candles[i-1].Low, candles[i].Low, candles[i+1].Low, candles[i+2].Low):
-            swing_low = candles[i].Low
-            break
-    return swing_low
+    swing_index, start, end = get_swing_index(candles)
+    return swing_index.prev_swing_low(start, end)
 
+#latest High which is the highest of 5 candles around it
 def find_prev_swing_high(candles: list[Tick]) -> float:
 
-    swing_high = candles[-1].High
-    for i in range(-3, -len(candles)+2, -1):
-        if candles[i].High == max(candles[i-2].High, candles[i-1].High, candles[i].High, candles[i+1].High, candles[i+2].High):
-            swing_low = candles[i].High
-            break
-    return swing_high
+    swing_index, start, end = get_swing_index(candles)
+    return swing_index.prev_swing_high(start, end)
 
 
-def b_end_of_day_closing(candle: Tick, settings: StrategySettings, instrument: Instr):
+#candles - history up to the current candle, number of candles before market close is taken from the day index of the series
+def b_end_of_day_closing(candles: list[Tick] | CandleWindow, settings: StrategySettings, instrument: Instr):
 
     b_eod = False
     if settings.close_shorts_on_day_end:
-        candles_before_mrkt_close = candles_until_end_of_day(candle.Time, instrument.day_end, settings.candles_int)
+        day_index, _, end = get_day_index(candles)
+        candles_before_mrkt_close = day_index.bars_to_close(instrument.day_end, settings.candles_int).item(end-1)
         if candles_before_mrkt_close <= 1:
             b_eod = True
-            logger.debug(f"b_end_of_day_closing(): Day end close SELL order: {candle.Time}")
+            logger.debug(f"b_end_of_day_closing(): Day end close SELL order: {candles[-1].Time}")
     return b_eod
 
+#positions of all candles where b_end_of_day_closing() is True
+def end_of_day_closing_candles(candles: list[Tick] | CandleWindow, settings: StrategySettings, instrument: Instr) -> np.ndarray:
 
-def run_strategy(candles: list[Tick], params: list, settings: StrategySettings, instrument: Instr, current_order: Order, only_sl_tp_check: bool = False) -> StrategyResp:
+    if not settings.close_shorts_on_day_end:
+        return np.empty(0, dtype=np.int64)
+    day_index, start, end = get_day_index(candles)
+    return np.flatnonzero(day_index.bars_to_close(instrument.day_end, settings.candles_int)[start:end] <= 1)
+
+
+#candles - list of Tick or CandleWindow (strategy tester passes window over history to avoid copying it every bar).
+#Strategies from strategy_functions should only index, slice, iterate and take len() of candles
+def run_strategy(candles: list[Tick] | CandleWindow, params: list, settings: StrategySettings, instrument: Instr, current_order: Order, only_sl_tp_check: bool = False) -> StrategyResp:
 
     #check SL and TP conditions
     if if_sl_condition(candles[-1], current_order):
@@ -666,7 +673,7 @@ def run_strategy(candles: list[Tick], params: list, settings: StrategySettings,
         return StrategyResp(StrategyCommand.UNSPECIFIED)
 
     #check is it is end of day and if we need to close active SELL order
-    b_eod = b_end_of_day_closing(candles[-1], settings, instrument)
+    b_eod = b_end_of_day_closing(candles, settings, instrument)
     if b_eod and current_order.direction == OrderDir.SELL and current_order.status == OrderStatus.OPEN:
         return StrategyResp(StrategyCommand.CLOSE_SELL, OrderChangeReason.END_DAY)
 
@@ -1,20 +1,28 @@
 ﻿from collections import namedtuple
 import os
 import time
+import math
+import heapq
+import bisect
+import numpy as np
 from datetime import timedelta, datetime
 from itertools import product
+from concurrent.futures import ProcessPoolExecutor
 from tinkoff.invest.utils import now
 
 from readsettings import read_strategy_settings, StrategySettings
-from reports import StrategyLog, StratLog1Tick, SingleRunStrategyReport
-from schemas import Order, StrategyResp, OrderChangeReason
-from candles import Candles, Tick
+from reports import StrategyLog, StratLog1Tick, SingleRunStrategyReport, ResultsCube, SparseResultsCube
+from schemas import Order, StrategyResp, OrderChangeReason, TradeLedger
+from candles import Candles, Tick, CandleWindow, CandleSeries, get_column
 from strategydata import Instr
-from indicatorvals import save_indicators_to_file
+from indicatorvals import save_indicators_to_file, load_indicators_from_file, IndicatorsMatrix
+from indicators import Indicators
 from utils import get_settings_filenames, setup_logger, weekdays_2_calendardays, get_account_token, get_day_len_in_candles
-from globals import STRATEGY_MIN_ORDERS, STRATEGY_MIN_PROFIT_ORDERS_PERCENT, STATS_FOLDER, DATA_FOLDER, WORK_DAYS_RATE
-from globals import OrderStatus, StrategyCommand, OrderDir
-from strategies2 import run_strategy
+import globals as gl
+from globals import STRATEGY_MIN_ORDERS, STRATEGY_MIN_PROFIT_ORDERS_PERCENT, STATS_FOLDER, DATA_FOLDER, WORK_DAYS_RATE, ABORT_MIN_BARS_PER_ORDER, SWEEP_TOP_REPORTS
+from globals import OrderStatus, StrategyCommand, OrderDir, PerformedAction
+from strategies2 import run_strategy, end_of_day_closing_candles
+from paramsearch import successive_halving, tpe_search, grid_refinement
 
 #logger = setup_logger("log_" + datetime.now().strftime('%Y-%m-%d'))
 logger = setup_logger(__name__)
@@ -76,7 +84,7 @@ def strategy_tester(settings_file: str, ticker: str = "", shorts_enabled: bool =
     #WORK_DAYS_RATE is a magic number - approx ratio of working and not working days in Russia.
     startdate = settings.candles_enddate - timedelta(days=int((needed_candles_num/settings.day_len)/WORK_DAYS_RATE) + 1)
     enddate =settings.candles_enddate
-    candles = Candles(settings.skip_holidays, settings.skip_morning_hours, settings.skip_evening_hours).collect(settings, startdate, enddate, b_save=True)
+    candles = CandleSeries(Candles(settings.skip_holidays, settings.skip_morning_hours, settings.skip_evening_hours).collect(settings, startdate, enddate, b_save=True))
     logger.info(f"strategy_tester(): {settings.ticker} Candles collected: {len(candles)} (from {startdate} to {enddate}). Settings asked: {settings.candles_num}")
     logger.info(f"strategy_tester(): Testing strategy : {settings.strategy_name} for {settings.ticker}")
     logger.info(f"strategy_tester(): Choose best params approach: {settings.strategy_selection}")
@@ -85,9 +93,12 @@ def strategy_tester(settings_file: str, ticker: str = "", shorts_enabled: bool =
         instrument.spread = (settings.spread * candles[-1].Close)/100.0
         logger.info(f"strategy_tester(): Override spread with settings value: {instrument.spread}(or {settings.spread}%)")
 
-    all_reports = test_strategy(settings, candles, instrument=instrument)
+    #only best reports of the sweep are returned, every run is in summary.log and in results cube
+    #dense cube is made only for searches that run the whole grid (or most of it), sampled ones keep visited cells only
+    cube = ResultsCube(settings.params) if settings.param_search in ("grid", "halving", "refine") else SparseResultsCube(settings.params)
+    all_reports = test_strategy(settings, candles, instrument=instrument, cube=cube)
     all_reports.sort(reverse=True, key=lambda report: report.profitability)
-    save_summary(all_reports, STATS_FOLDER + "/" + settings.ticker + "/" + settings.strategy_name)
+    cube.save(os.path.join(STATS_FOLDER, settings.ticker, settings.strategy_name))
     
     #update all indicators if I used them (ugly)
     if instrument and instrument.indicators_were_updated:
@@ -112,16 +123,22 @@ def strategy_tester(settings_file: str, ticker: str = "", shorts_enabled: bool =
     elif settings.strategy_selection == "Reliable":
         best_report = choose_best_params_reliable(all_reports, settings.numdays, settings.min_profit_ord_percent)
     elif settings.strategy_selection == "Weighted":
-        st =  (timenow - timedelta(days=settings.numdays)) if settings.numdays > 0 else settings.start_date
-        end = timenow if settings.numdays > 0 else settings.end_date
-        best_report = choose_best_params_weighted(all_reports, st, end)
+        #orders are weighted within the period of every run (see weighted_profitability)
+        best_report = choose_best_params_weighted(all_reports)
+    elif settings.strategy_selection == "Robust":
+        best_report = choose_best_params_robust(cube, all_reports, candles[:-int(settings.candles_num * settings.backtest_percent)], settings, instrument)
     else:
         best_report = choose_best_params_profit(all_reports)
 
-    #detailed logs to file
+    #detailed logs to file. Sweep runs without strategy log - best params (and top "strategy_log_top" by profitability) 
+    #are run again candle by candle to get it
     if settings.strategy_log and best_report:
-        best_report.save_report(os.path.join(STATS_FOLDER, settings.ticker, settings.strategy_name))
-        best_report.strategy_log.save(settings.ticker, settings.strategy_name)
+        in_sample_candles = candles[:-int(settings.candles_num * settings.backtest_percent)]
+        log_reports = [best_report] + [x for x in all_reports[:settings.strategy_log_top] if x is not best_report and not x.pruned]
+        for report in log_reports:
+            report.strategy_log = strategy_single_run(in_sample_candles, settings, report.params, instrument, b_log_strategy=True).strategy_log
+            report.save_report(os.path.join(STATS_FOLDER, settings.ticker, settings.strategy_name))
+            report.strategy_log.save(settings.ticker, settings.strategy_name)
 
 
     if not best_report:
@@ -144,7 +161,8 @@ def strategy_tester(settings_file: str, ticker: str = "", shorts_enabled: bool =
 
 #strategy - function that implements strategy  
 #parameters - parameters for strategy
-def test_strategy(settings: StrategySettings, candles: list[Tick], instrument: Instr = None):
+#cube - if set, KPIs of every run are added to it
+def test_strategy(settings: StrategySettings, candles: list[Tick], instrument: Instr = None, cube: ResultsCube = None):
 
     #make folders structure for reports
     ticker_dir = STATS_FOLDER + "/" + settings.ticker
@@ -154,8 +172,6 @@ def test_strategy(settings: StrategySettings, candles: list[Tick], instrument: I
     if not os.path.exists(strat_dir): 
         os.mkdir(strat_dir)
 
-    all_params_combinations = make_list_of_experiments(settings)
-
     
     in_sample_candles =  candles[:-int(settings.candles_num * settings.backtest_percent)]  #all candles minus 30% (reserve them for back test)
     in_sample_start_index = len(candles) - settings.candles_num
@@ -163,9 +179,49 @@ def test_strategy(settings: StrategySettings, candles: list[Tick], instrument: I
     out_sample_start_index = len(candles) - int(settings.candles_num * settings.backtest_percent)
 
 
-    all_reports = train_strategy(in_sample_candles, settings, all_params_combinations, instrument)
-    
-    return all_reports
+    #SMA/EMA for all periods that may appear in params are calculated once and shared by all combinations
+    #matrix is made of these candles only - it must not stay in globals after the sweep (even if it fails)
+    gl.SMA_INDICATORS_MATRIX = IndicatorsMatrix(candles, get_params_values(settings))
+    pool = None
+    try:
+        #workers are started once: search functions call evaluate() many times with small batches of combinations
+        workers = get_sweep_workers(settings)
+        pool = start_sweep_pool(in_sample_candles, settings, instrument, workers) if workers > 1 else None
+
+        with ReportsCollector(settings, strat_dir, cube=cube) as collector:
+            evaluate = lambda params_combinations, test_len: train_strategy(in_sample_candles, settings, params_combinations, instrument, test_len, pool=pool)
+            if settings.param_search == "tpe":
+                #full list of combinations is not made - it may be too big for grid search
+                all_reports = tpe_search([list(range(i[1], i[2], i[3])) for i in settings.params], evaluate, lambda report: score_report(report, settings),
+                                         settings.search_budget, settings.search_seed, lambda params: is_valid_experiment(settings, params))
+            elif settings.param_search == "refine":
+                all_reports = grid_refinement([list(range(i[1], i[2], i[3])) for i in settings.params], evaluate, lambda report: score_report(report, settings),
+                                              lambda params: is_valid_experiment(settings, params), grid_size=count_valid_experiments(settings))
+            elif settings.param_search == "halving":
+                all_reports = successive_halving(make_list_of_experiments(settings), evaluate, lambda report: score_report(report, settings),
+                                                 int(settings.candles_num * (1-settings.backtest_percent)))
+            else:
+                #grid reports go to collector one by one, they are never kept all together
+                all_reports = train_strategy(in_sample_candles, settings, make_list_of_experiments(settings), instrument, collector=collector, pool=pool)
+
+            for report in all_reports:
+                collector.add(report)
+            return collector.close()
+    finally:
+        if pool:
+            pool.shutdown()
+        gl.SMA_INDICATORS_MATRIX = None
+
+'''
+All values of all parameters from settings (periods of indicators to pre-calculate)
+'''
+def get_params_values(settings: StrategySettings) -> list[int]:
+
+    values = set()
+    for i in settings.params:
+        values.update(range(i[1], i[2], i[3]))
+
+    return sorted(values)
 
 
 '''
@@ -180,22 +236,47 @@ def make_list_of_experiments(settings: StrategySettings):
 
     all_combinations = list(product(*range_of_params))
 
-    if settings.strategy_name in ("strategy_MACD", "strategy_MACD_sl_tp", "strategy_MACD_simple", "strategy_MA_cross", "strategy_MA_cross_sl_tp", "strategy_MA_cross_sl", "strategy_MA_cross_simple", "strategy_MA_Volume", "strategy_MA_Volume_sl", "strategy_MA_ADX_sl", "strategy_MA_cross_price_deviation", "strategy_EMA_cross", "strategy_EMA_cross_simple", "strategy_ADX_MA", "strategy_MACD_RSI", "strategy_trend_pullback"):
-        filtered_params = [t for t in all_combinations if t[0] < t[1]]
-    else:
-        filtered_params = all_combinations[:]
+    filtered_params = [t for t in all_combinations if is_valid_experiment(settings, t)]
 
     logger.debug(f"make_list_of_experiments(): all experiments: {filtered_params}")
 
     return filtered_params
 
-def train_strategy(in_sample_candles: list[Tick], settings: StrategySettings, all_params_combinations: list[tuple], instrument: Instr = None):
+#strategies where first parameter (fast period) must be less than the second one (slow period)
+FAST_SLOW_STRATEGIES = ("strategy_MACD", "strategy_MACD_sl_tp", "strategy_MACD_simple", "strategy_MA_cross", "strategy_MA_cross_sl_tp", "strategy_MA_cross_sl", "strategy_MA_cross_simple", "strategy_MA_Volume", "strategy_MA_Volume_sl", "strategy_MA_ADX_sl", "strategy_MA_cross_price_deviation", "strategy_EMA_cross", "strategy_EMA_cross_simple", "strategy_ADX_MA", "strategy_MACD_RSI", "strategy_trend_pullback")
+
+def is_valid_experiment(settings: StrategySettings, params: tuple) -> bool:
+    return params[0] < params[1] if settings.strategy_name in FAST_SLOW_STRATEGIES else True
+
+def count_valid_experiments(settings: StrategySettings) -> int:
+    '''Number of combinations make_list_of_experiments() returns, without making them: fast < slow pairs are counted 
+       by one bisect of the slow values per fast value (same rule as is_valid_experiment)'''
+    ranges = [range(i[1], i[2], i[3]) for i in settings.params]
+    if settings.strategy_name not in FAST_SLOW_STRATEGIES:
+        return math.prod(len(r) for r in ranges)
+    slow = sorted(ranges[1])
+    pairs = sum(len(slow) - bisect.bisect_right(slow, fast) for fast in ranges[0])
+    return pairs * math.prod(len(r) for r in ranges[2:])
+
+#test_len - number of last candles strategy is tested on (-1 - whole test period of in-sample candles)
+#collector - if set, reports are passed to it instead of being returned (ReportsCollector)
+#pool - workers started by start_sweep_pool (for the same candles/settings/instrument), if not set train_strategy_parallel starts its own
+def train_strategy(in_sample_candles: list[Tick], settings: StrategySettings, all_params_combinations: list[tuple], instrument: Instr = None, test_len: int = -1,
+                   collector: "ReportsCollector" = None, pool: ProcessPoolExecutor = None):
+
+    workers = get_sweep_workers(settings)
+    if workers > 1 and len(all_params_combinations) > 1:
+        return train_strategy_parallel(in_sample_candles, settings, all_params_combinations, instrument, workers, test_len, collector, pool)
 
     all_reports = []
     counter = 0
+    single_run = get_single_run_function(settings)
     for iter in all_params_combinations:
-        report: SingleRunStrategyReport = strategy_single_run(in_sample_candles, settings, iter, instrument)        
-        all_reports.append(report)
+        report: SingleRunStrategyReport = single_run(in_sample_candles, settings, iter, instrument, test_len)        
+        if collector:
+            collector.add(report)
+        else:
+            all_reports.append(report)
         
         counter += 1
         if counter%200 == 0:
@@ -203,76 +284,458 @@ def train_strategy(in_sample_candles: list[Tick], settings: StrategySettings, al
 
     return all_reports
 
+'''
+Same as train_strategy, but experiments are spread across a pool of "workers" processes.
+Every worker gets its own copy of candles/settings/instrument and runs chunks of parameters combinations.
+Reports are merged in the order of all_params_combinations, so result doesn't depend on number of workers.
+New values of pre-calculated indicators found by workers are merged back into instrument.indicators
+'''
+def train_strategy_parallel(in_sample_candles: list[Tick], settings: StrategySettings, all_params_combinations: list[tuple], instrument: Instr = None, workers: int = 2, test_len: int = -1,
+                            collector: "ReportsCollector" = None, pool: ProcessPoolExecutor = None):
+
+    chunk_size = max(1, len(all_params_combinations)//(workers*4))
+    chunks = [all_params_combinations[i:i+chunk_size] for i in range(0, len(all_params_combinations), chunk_size)]
+    logger.info(f"train_strategy_parallel(): {len(all_params_combinations)} experiments in {len(chunks)} chunks on {workers} workers")
+
+    all_reports = []
+    counter = 0
+    #_init_sweep_worker sets the matrix global of the process it runs in - the caller's value is restored whatever happens
+    matrix = gl.SMA_INDICATORS_MATRIX
+    own_pool = pool is None
+    try:
+        if own_pool:
+            pool = start_sweep_pool(in_sample_candles, settings, instrument, workers)
+        #map() returns results in order of chunks - it makes merge deterministic
+        for reports, indicator_updates in pool.map(_run_sweep_chunk, chunks, [test_len]*len(chunks)):
+            if collector:
+                for report in reports:
+                    collector.add(report)
+            else:
+                all_reports.extend(reports)
+            _merge_indicator_updates(instrument, indicator_updates)
+
+            counter += len(reports)
+            logger.info(f"train_strategy_parallel(): {counter} of {len(all_params_combinations)} experiments done")
+    finally:
+        if own_pool and pool:
+            pool.shutdown()
+        gl.SMA_INDICATORS_MATRIX = matrix
+
+    return all_reports
+
+def get_sweep_workers(settings: StrategySettings) -> int:
+    return settings.sweep_workers if settings.sweep_workers > 0 else os.cpu_count()
+
+def start_sweep_pool(in_sample_candles: list[Tick], settings: StrategySettings, instrument: Instr, workers: int) -> ProcessPoolExecutor:
+    '''Pool of "workers" processes for train_strategy_parallel. Candles, settings, instrument and indicators matrix (from globals) 
+       are copied to every worker once, when it starts. Caller shuts the pool down'''
+    #load all indicator caches before starting workers, so every worker starts with the same content
+    if instrument and instrument.use_precalculated_indicators:
+        for name in instrument.indicators.keys():
+            if not instrument.indicators[name]:
+                instrument.indicators[name] = load_indicators_from_file(instrument.ticker, name)
+
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker, initargs=(in_sample_candles, settings, instrument, gl.SMA_INDICATORS_MATRIX))
+
+#state of the sweep worker process (set once by _init_sweep_worker)
+_sweep_worker = {}
+
+def _init_sweep_worker(candles: list[Tick], settings: StrategySettings, instrument: Instr, indicators_matrix: IndicatorsMatrix):
+    gl.SMA_INDICATORS_MATRIX = indicators_matrix
+    _sweep_worker["candles"] = candles
+    _sweep_worker["settings"] = settings
+    _sweep_worker["instrument"] = instrument
+    #journal position of every indicators cache: values after it are not yet sent to main process
+    _sweep_worker["sent"] = {name: ind.mark() for name, ind in instrument.indicators.items() if ind} if instrument else {}
+
+def _run_sweep_chunk(params_chunk: list[tuple], test_len: int = -1):
+
+    instrument: Instr = _sweep_worker["instrument"]
+    single_run = get_single_run_function(_sweep_worker["settings"])
+    reports = [single_run(_sweep_worker["candles"], _sweep_worker["settings"], params, instrument, test_len) for params in params_chunk]
+
+    #collect indicator values calculated by this chunk
+    indicator_updates = {}
+    if instrument and instrument.indicators_were_updated:
+        for name, ind in instrument.indicators.items():
+            sent = _sweep_worker["sent"].get(name, 0)
+            if ind and ind.mark() > sent:
+                indicator_updates[name] = ind.updates_since(sent)
+                _sweep_worker["sent"][name] = ind.mark()
+
+    return reports, indicator_updates
+
+def _merge_indicator_updates(instrument: Instr, indicator_updates: dict):
+
+    for name, values in indicator_updates.items():
+        if not instrument.indicators[name]:
+            instrument.indicators[name] = load_indicators_from_file(instrument.ticker, name)
+        instrument.indicators[name].update(values)
+        instrument.indicators_were_updated = True
+
+class RunAbortRules:
+    '''Rules to stop a single run (settings abort_max_drawdown and abort_min_orders):
+       drawdown of equity after closed orders is bigger than allowed - run is stopped even if it would recover later,
+       or the run can't reach min orders of the selector even if it opens an order on every candle left where the strategy can open it:
+       "order_candles" (see get_order_candles), or every ABORT_MIN_BARS_PER_ORDER candles if they are not known.
+       Min orders rule is used only for runs over the whole in-sample period (selectors check orders of them only)'''
+    def __init__(self, settings: StrategySettings, start_index: int, candles_num: int, order_candles: np.ndarray = None):
+        self.max_drawdown = settings.abort_max_drawdown/100
+        self.start_index = start_index
+        self.last_index = candles_num - 1
+        self.order_candles = order_candles
+        self.min_orders = 0
+        if settings.abort_min_orders and candles_num - start_index >= int(settings.candles_num * (1-settings.backtest_percent)):
+            self.min_orders = get_min_orders(settings)
+        self.equity = self.peak = settings.start_capital
+        self.orders_counted = 0
+
+    def is_hopeless(self, i: int, report: list, current_order: Order) -> bool:
+        '''Check after candle "i" was processed. report - orders closed so far'''
+        for order in report[self.orders_counted:]:
+            self.equity += order.profit
+            self.peak = max(self.peak, self.equity)
+            if self.max_drawdown > 0 and (self.peak - self.equity)/self.peak > self.max_drawdown:
+                return True
+        self.orders_counted = len(report)
+
+        return self.min_orders > 0 and self._few_orders(self._orders(report, current_order), i)
+
+    def min_orders_abort_candle(self, report: list, current_order: Order) -> int:
+        '''First candle where the run is stopped by min orders rule if no orders are opened or closed before it 
+           (vector engine jumps over candles without events)'''
+        needed = self.min_orders - self._orders(report, current_order)
+        if self.min_orders <= 0 or needed <= 0:
+            return self.last_index + 1
+        #first candle "i" where _few_orders() is True
+        if self.order_candles is not None:
+            return self.start_index if needed > len(self.order_candles) else max(self.start_index, int(self.order_candles[-needed]))
+        return max(self.start_index, self.last_index - needed*ABORT_MIN_BARS_PER_ORDER + 1)
+
+    def _orders(self, report: list, current_order: Order) -> int:
+        #open order is closed at the end of the run, so it is counted too
+        return len(report) + (1 if current_order.status == OrderStatus.OPEN else 0)
+
+    def _few_orders(self, orders: int, i: int) -> bool:
+        '''Even with an order on every candle after candle "i" where it can be opened the run ends with less than min orders'''
+        if self.order_candles is not None:
+            orders_left = len(self.order_candles) - int(np.searchsorted(self.order_candles, i, side="right"))
+        else:
+            orders_left = (self.last_index - i)//ABORT_MIN_BARS_PER_ORDER
+        return orders + orders_left < self.min_orders
+
+def get_abort_rules(settings: StrategySettings, start_index: int, candles_num: int, order_candles: np.ndarray = None) -> RunAbortRules:
+    if settings.abort_max_drawdown > 0 or settings.abort_min_orders:
+        return RunAbortRules(settings, start_index, candles_num, order_candles)
+    return None
+
+def get_order_candles(candles: list[Tick], settings: StrategySettings, params: list[int], instrument: Instr, start_index: int) -> np.ndarray:
+    '''Candles from start_index where a strategy can open an order: crosses of fast and slow MA for VECTOR_ENGINE_STRATEGIES
+       (they open orders only on crosses). None for other strategies'''
+    ma_kind = VECTOR_ENGINE_STRATEGIES.get(settings.strategy_name, None)
+    if not ma_kind:
+        return None
+
+    series: VectorSeries = get_vector_series(candles, settings, instrument)
+    ma_fast = series.get_ma(ma_kind, params[0])
+    ma_slow = series.get_ma(ma_kind, params[1])
+    #MA cross on candle i (comparisons with NaN are False, so candles without enough history never give a signal)
+    cross = np.zeros(len(candles), dtype=bool)
+    cross[1:] = ((ma_fast[:-1] < ma_slow[:-1]) & (ma_fast[1:] > ma_slow[1:])) | ((ma_fast[:-1] > ma_slow[:-1]) & (ma_fast[1:] < ma_slow[1:]))
+    return np.flatnonzero(cross[start_index:]) + start_index
+
 '''
 Run strategy on historical data set with concrete parameters
 in - list of Tick = namedtuple('Tick', ['Time','Open','Close','Low','High','Volume'])
    - strategy params in form of [1,2,3,4] where 1,2,3,4 are up to 4 parameters of the strategy
+   - test_len - number of last candles to run strategy on (-1 - whole test period)
+   - b_log_strategy - collect strategy log (command, indicators, SL/TP on every candle). It is off during parameters sweep
 out - report
 '''
-def strategy_single_run(candles: list[Tick], settings: StrategySettings, params: list[int], instrument: Instr = None):
+def strategy_single_run(candles: list[Tick], settings: StrategySettings, params: list[int], instrument: Instr = None, test_len: int = -1, b_log_strategy: bool = False):
 
     current_order = Order(OrderDir.UNSPECIFIED, lots=1, price=0, time=datetime.now(), status=OrderStatus.CLOSED, sl=-1, tp=-1)
-    one_run_report = []
+    one_run_report = TradeLedger()
     strategy_log = StrategyLog()
 
-    start_index = len(candles) - int(settings.candles_num * (1-settings.backtest_percent))
+    start_index = len(candles) - (test_len if test_len > 0 else int(settings.candles_num * (1-settings.backtest_percent)))
+
+    #candles where orders can be opened are needed only by min orders rule
+    order_candles = get_order_candles(candles, settings, params, instrument, start_index) if settings.abort_min_orders else None
+    abort_rules = get_abort_rules(settings, start_index, len(candles), order_candles)
+    last_index = len(candles) - 1
 
     logger.debug(f"strategy_single_run(): Start date: {candles[start_index].Time}, End date: {candles[-1].Time}, Candles between: {len(candles) - start_index} ({(candles[-1].Time - candles[start_index].Time).days} days)")
     for i in range(start_index, len(candles)):
 
-        resp: StrategyResp = run_strategy(candles[:i+1], params, settings, instrument, current_order)        
+        #strategy sees candles[:i+1] through a window, so history is not copied on every bar
+        resp: StrategyResp = run_strategy(CandleWindow(candles, 0, i+1), params, settings, instrument, current_order)        
+        apply_strategy_command(resp, candles[i], current_order, settings, params, instrument.spread, one_run_report)
 
-        if resp.cmd == StrategyCommand.OPEN_BUY:
-            current_order.close(OrderDir.SELL, candles[i], resp.reason, instrument.spread, one_run_report)
-            current_order.open(OrderDir.BUY, candles[i], resp.sl, resp.tp, resp.reason, lots=1, params=params)
+        if b_log_strategy:
+            strategy_log.add(StratLog1Tick(candles[i], resp.indicator_values, params, strat_ord=resp.cmd, reason=resp.reason, sl=resp.sl, tp=resp.tp, action=current_order.last_action))
 
-        elif resp.cmd == StrategyCommand.OPEN_SELL:
-            current_order.close(OrderDir.BUY, candles[i], resp.reason, instrument.spread, one_run_report)
-            if settings.shorts_enabled:
-                current_order.open(OrderDir.SELL, candles[i], resp.sl, resp.tp, resp.reason, lots=1, params=params)
-        
-        elif resp.cmd == StrategyCommand.CLOSE_BUY:
-            current_order.close(OrderDir.BUY, candles[i], resp.reason, instrument.spread, one_run_report)
+        if abort_rules and abort_rules.is_hopeless(i, one_run_report, current_order):
+            last_index = i
+            break
+
+    #end of strrategy run. Closing last order if any.
+    current_order.close(OrderDir.BUY, candles[last_index], OrderChangeReason.END_TREND, instrument.spread, one_run_report)
+    current_order.close(OrderDir.SELL, candles[last_index], OrderChangeReason.END_TREND, instrument.spread, one_run_report)
 
-        elif resp.cmd == StrategyCommand.CLOSE_SELL:
-            current_order.close(OrderDir.SELL, candles[i], resp.reason, instrument.spread, one_run_report)
+    report = SingleRunStrategyReport(one_run_report, params, settings.start_capital, strategy_log, candles[start_index].Time, candles[last_index].Time)
+    report.test_len = len(candles) - start_index
+    report.bars_saved = len(candles) - 1 - last_index
+    report.pruned = report.bars_saved > 0
+    report.generate_report()
+    report.calcuate_CAGR(candles[start_index].Time, candles[last_index].Time)
+    report.calculate_Sharpe()
+    report.calculate_Profit_Factor()
+    report.calcuate_max_drawdown()
 
-        elif resp.cmd == StrategyCommand.CLOSE_ALL:
-            current_order.close(OrderDir.BUY, candles[i], resp.reason, instrument.spread, one_run_report)
-            current_order.close(OrderDir.SELL, candles[i], resp.reason, instrument.spread, one_run_report)
+    return report
 
-        elif resp.cmd == StrategyCommand.UNSPECIFIED:
-            pass
-        else:
-            logger.error(f"strategy_single_run(): order returned by strategy is not supported - {resp.cmd}")
+'''
+Open/close current order according to the command returned by run_strategy. Closed orders are added to "report"
+'''
+def apply_strategy_command(resp: StrategyResp, candle: Tick, current_order: Order, settings: StrategySettings, params: list[int], spread: float, report: list):
 
-        strategy_log.add(StratLog1Tick(candles[i], resp.indicator_values[:], params, strat_ord=resp.cmd, reason=resp.reason, sl=resp.sl, tp=resp.tp, action=current_order.last_action))
+    if resp.cmd == StrategyCommand.OPEN_BUY:
+        current_order.close(OrderDir.SELL, candle, resp.reason, spread, report)
+        current_order.open(OrderDir.BUY, candle, resp.sl, resp.tp, resp.reason, lots=1, params=params)
+
+    elif resp.cmd == StrategyCommand.OPEN_SELL:
+        current_order.close(OrderDir.BUY, candle, resp.reason, spread, report)
+        if settings.shorts_enabled:
+            current_order.open(OrderDir.SELL, candle, resp.sl, resp.tp, resp.reason, lots=1, params=params)
+    
+    elif resp.cmd == StrategyCommand.CLOSE_BUY:
+        current_order.close(OrderDir.BUY, candle, resp.reason, spread, report)
+
+    elif resp.cmd == StrategyCommand.CLOSE_SELL:
+        current_order.close(OrderDir.SELL, candle, resp.reason, spread, report)
+
+    elif resp.cmd == StrategyCommand.CLOSE_ALL:
+        current_order.close(OrderDir.BUY, candle, resp.reason, spread, report)
+        current_order.close(OrderDir.SELL, candle, resp.reason, spread, report)
+
+    elif resp.cmd == StrategyCommand.UNSPECIFIED:
+        pass
+    else:
+        logger.error(f"apply_strategy_command(): order returned by strategy is not supported - {resp.cmd}")
+
+    return
+
+'''
+Vector engine: same as strategy_single_run, but for strategies from VECTOR_ENGINE_STRATEGIES.
+Moving averages and their crosses are calculated for the whole candles series at once (numpy), then run_strategy is called
+only on "event" candles - MA cross, SL/TP hit, end of day for SELL order, restore of SELL order after end of day.
+On all other candles run_strategy would return "do nothing", so orders and report are the same as from strategy_single_run.
+Strategy log is not collected (it would contain only event candles).
+'''
+def strategy_single_run_vector(candles: list[Tick], settings: StrategySettings, params: list[int], instrument: Instr = None, test_len: int = -1):
+
+    ma_kind = VECTOR_ENGINE_STRATEGIES.get(settings.strategy_name, None)
+    if not ma_kind or settings.trail_stops:
+        #trailing stops are changed on every candle - no way to skip candles
+        return strategy_single_run(candles, settings, params, instrument, test_len)
+
+    current_order = Order(OrderDir.UNSPECIFIED, lots=1, price=0, time=datetime.now(), status=OrderStatus.CLOSED, sl=-1, tp=-1)
+    one_run_report = TradeLedger()
+
+    start_index = len(candles) - (test_len if test_len > 0 else int(settings.candles_num * (1-settings.backtest_percent)))
+    candles_num = len(candles)
+
+    series: VectorSeries = get_vector_series(candles, settings, instrument)
+    signals = get_order_candles(candles, settings, params, instrument, start_index)
+
+    abort_rules = get_abort_rules(settings, start_index, candles_num, signals)
+    last_index = candles_num - 1
+
+    i = start_index
+    while i < candles_num:
+        i = _next_event_candle(i, series, signals, current_order)
+        if abort_rules:
+            #run may be stopped by min orders rule on a candle without event
+            abort_index = abort_rules.min_orders_abort_candle(one_run_report, current_order)
+            if abort_index < min(i, candles_num):
+                last_index = int(abort_index)
+                break
+        if i >= candles_num:
+            break
+
+        resp: StrategyResp = run_strategy(CandleWindow(candles, 0, i+1), params, settings, instrument, current_order)
+        apply_strategy_command(resp, candles[i], current_order, settings, params, instrument.spread, one_run_report)
+        #abort rules are checked on events only (nothing changes between them)
+        if abort_rules and abort_rules.is_hopeless(i, one_run_report, current_order):
+            last_index = int(i)
+            break
+        i += 1
 
     #end of strrategy run. Closing last order if any.
-    current_order.close(OrderDir.BUY, candles[-1], OrderChangeReason.END_TREND, instrument.spread, one_run_report)
-    current_order.close(OrderDir.SELL, candles[-1], OrderChangeReason.END_TREND, instrument.spread, one_run_report)
+    current_order.close(OrderDir.BUY, candles[last_index], OrderChangeReason.END_TREND, instrument.spread, one_run_report)
+    current_order.close(OrderDir.SELL, candles[last_index], OrderChangeReason.END_TREND, instrument.spread, one_run_report)
 
-    report = SingleRunStrategyReport(one_run_report, params, settings.start_capital, strategy_log, candles[start_index].Time, candles[-1].Time)
+    report = SingleRunStrategyReport(one_run_report, params, settings.start_capital, StrategyLog(), candles[start_index].Time, candles[last_index].Time)
+    report.test_len = candles_num - start_index
+    report.bars_saved = candles_num - 1 - last_index
+    report.pruned = report.bars_saved > 0
     report.generate_report()
-    report.calcuate_CAGR(candles[start_index].Time, candles[-1].Time)
+    report.calcuate_CAGR(candles[start_index].Time, candles[last_index].Time)
     report.calculate_Sharpe()
     report.calculate_Profit_Factor()
     report.calcuate_max_drawdown()
 
     return report
 
-def save_summary(all_reports, report_dir):
-
-    file_name = report_dir + "/summary.log"
-    file_report = open(file_name, 'w', newline='')
+'''
+Find first candle starting from "i" where run_strategy may do something with current order
+'''
+def _next_event_candle(i: int, series: "VectorSeries", signals: np.ndarray, current_order: Order) -> int:
+
+    n = signals.searchsorted(i)
+    next_event = signals[n] if n < len(signals) else len(series.close)
+
+    if current_order.status == OrderStatus.OPEN:
+        if current_order.direction == OrderDir.SELL and len(series.eod_candles) > 0:
+            n = series.eod_candles.searchsorted(i)
+            if n < len(series.eod_candles):
+                next_event = min(next_event, series.eod_candles[n])
+
+        #same conditions as in if_sl_condition()/if_tp_condition()
+        hits = np.zeros(next_event - i, dtype=bool)
+        if current_order.sl > 0:
+            hits |= series.low[i:next_event] <= current_order.sl if current_order.direction == OrderDir.BUY else series.high[i:next_event] >= current_order.sl
+        if current_order.tp > 0:
+            hits |= series.close[i:next_event] >= current_order.tp if current_order.direction == OrderDir.BUY else series.close[i:next_event] <= current_order.tp
+        if hits.any():
+            next_event = i + int(hits.argmax())
+
+    elif current_order.last_action == PerformedAction.CLOSED_SELL and current_order.reason == OrderChangeReason.END_DAY:
+        #SELL order closed at the end of day is restored on the next candle
+        next_event = i
+
+    return next_event
+
+#strategies supported by vector engine and moving average they use
+VECTOR_ENGINE_STRATEGIES = {"strategy_MA_cross": "SMA", "strategy_MA_cross_sl": "SMA", "strategy_MA_cross_sl_tp": "SMA", "strategy_EMA_cross": "EMA"}
+
+class VectorSeries:
+    '''Candles as numpy arrays and moving averages for the whole series. Calculated once and shared by all runs of a sweep'''
+    def __init__(self, candles: list[Tick], settings: StrategySettings, instrument: Instr):
+        self.candles = candles
+        self.close = np.array(get_column(candles, "Close"), dtype=float)
+        self.low = np.array(get_column(candles, "Low"), dtype=float)
+        self.high = np.array(get_column(candles, "High"), dtype=float)
+        self.ma: dict[tuple, np.ndarray] = {}
+        #candles where active SELL order is closed because of end of day
+        self.eod_candles = end_of_day_closing_candles(candles, settings, instrument)
+
+    def get_ma(self, kind: str, period: int) -> np.ndarray:
+        ma = self.ma.get((kind, period), None)
+        if ma is None:
+            matrix: IndicatorsMatrix = gl.SMA_INDICATORS_MATRIX
+            if matrix and matrix.covers(self.candles) and period in matrix.rows:
+                ma = matrix.row(kind, period)[:len(self.close)]
+            else:
+                ma = Indicators.sma_series(self.close, period) if kind == "SMA" else Indicators.ema_series(self.close, period)
+            self.ma[(kind, period)] = ma
+        return ma
+
+_vector_series: VectorSeries = None
+
+def get_vector_series(candles: list[Tick], settings: StrategySettings, instrument: Instr) -> VectorSeries:
+    global _vector_series
+    if _vector_series is None or _vector_series.candles is not candles:
+        _vector_series = VectorSeries(candles, settings, instrument)
+    return _vector_series
+
+def get_single_run_function(settings: StrategySettings):
+    return strategy_single_run_vector if settings.backtest_engine == "vector" else strategy_single_run
 
-    for iter in all_reports:
-        file_report.write("Margin: " + str(round(iter.profitability, 2)) \
-                          + "%, Orders: " + str(iter.num_orders) + "(" + str(iter.num_profit_orders) + "/"+ str(iter.num_loss_orders) + ")" \
-                          + " Params: " + str(iter.params) + ", % of profit orders: " + str(round(iter.profit_orders_percent,2)) + "\n")
+'''
+Collects reports of the sweep without keeping all of them in memory. Every report is written to summary.log (one line of KPIs),
+but only "top_k" best reports for "Profit" and for "strategy_selection" criterion from settings are kept.
+Kept reports are enough for choose_best_params_* to choose the same report as from all of them
+'''
+class ReportsCollector:
+
+    def __init__(self, settings: StrategySettings, report_dir: str, top_k: int = SWEEP_TOP_REPORTS, cube: ResultsCube = None):
+        self.settings = settings
+        self.top_k = top_k
+        self.cube = cube
+        #heap of (key, -number of report, report) for every criterion, the worst kept report is on top
+        self.heaps = {criterion: [] for criterion in dict.fromkeys(("Profit", settings.strategy_selection))}
+        self.count = 0
+        self.pruned = 0
+        self.bars_saved = 0
+        self.file_report = open(report_dir + "/summary.log", 'w', newline='')
+
+    def __enter__(self):
+        return self
+
+    #summary.log is closed even if the sweep fails, close() still has to be called to get reports
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file_report.close()
+
+    def add(self, report: SingleRunStrategyReport):
+        self.file_report.write(summary_line(report))
+        if self.cube:
+            self.cube.add(report)
+        self.count += 1
+        if report.pruned:
+            self.pruned += 1
+            self.bars_saved += report.bars_saved
+
+        for criterion, heap in self.heaps.items():
+            #of reports with the same key the first one is kept (as stable sort in choose_best_params_* does)
+            entry = (score_report(report, self.settings, criterion), -self.count, report)
+            if len(heap) < self.top_k:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+
+    def close(self) -> list[SingleRunStrategyReport]:
+        '''Finish summary.log and return kept reports in order they were added'''
+        if self.pruned:
+            self.file_report.write("Pruned runs: " + str(self.pruned) + " of " + str(self.count) + ", candles saved: " + str(self.bars_saved) + "\n")
+        self.file_report.close()
+
+        entries = {id(entry[2]): entry for heap in self.heaps.values() for entry in heap}
+        logger.info(f"ReportsCollector: {self.count} reports written to summary, {len(entries)} best of them kept")
+        return [entry[2] for entry in sorted(entries.values(), key=lambda entry: -entry[1])]
+
+def summary_line(report: SingleRunStrategyReport) -> str:
+    return "Margin: " + str(round(report.profitability, 2)) \
+           + "%, Orders: " + str(report.num_orders) + "(" + str(report.num_profit_orders) + "/"+ str(report.num_loss_orders) + ")" \
+           + " Params: " + str(report.params) + ", % of profit orders: " + str(round(report.profit_orders_percent,2)) \
+           + (", PRUNED (" + str(report.bars_saved) + " candles not run)" if report.pruned else "") + "\n"
 
-    file_report.close()
-    return
+'''
+Value to compare reports by for "criterion" (default - "strategy_selection" from settings), the bigger the better. Used by parameters search
+(paramsearch.py) and ReportsCollector to drop combinations before choose_best_params_* is called for the rest of them
+'''
+def score_report(report: SingleRunStrategyReport, settings: StrategySettings, criterion: str = None):
+
+    criterion = criterion if criterion else settings.strategy_selection
+    #runs stopped by abort rules go last, then runs with fewer orders than choose_best_params_* accepts.
+    #Runs on a part of the in-sample period (successive halving) are expected to make the same part of orders
+    min_orders = get_min_orders(settings, criterion)
+    if report.test_len > 0:
+        min_orders = min_orders * min(1.0, report.test_len / int(settings.candles_num * (1-settings.backtest_percent)))
+    usable = (not report.pruned, report.num_orders >= min_orders)
+    if criterion == "Reliable":
+        #reliable combinations go first, then by profitability
+        return usable + (report.profit_orders_percent >= settings.min_profit_ord_percent, report.profitability)
+    elif criterion == "Weighted":
+        return usable + (weighted_profitability(report),)
+    return usable + (report.profitability,)
+
+def weighted_profitability(report: SingleRunStrategyReport) -> float:
+    '''Profitability where recent orders weigh more: profit of every order is multiplied by get_order_profit_multiplier_exp() 
+       of its close time in the period of the run. Orders are not changed. Used by score_report and choose_best_params_weighted'''
+    return sum(round(100*order.profit*get_order_profit_multiplier_exp(report.start_date, report.end_date, order.c_time)/order.o_price, 2) 
+               for order in report.orders_history)
 
 def choose_best_params_profit(all_reports: list[SingleRunStrategyReport]) -> SingleRunStrategyReport:
 
@@ -280,8 +743,8 @@ def choose_best_params_profit(all_reports: list[SingleRunStrategyReport]) -> Sin
     min_orders = STRATEGY_MIN_ORDERS
     
     all_reports.sort(reverse=True, key=lambda report: report.profitability)
-    #take top 10 reports by profiability among those which have more total orders than "min_orders"
-    top_reports = [x for x in all_reports if x.num_orders >= min_orders][:number_of_best_values]
+    #take top 10 reports by profiability among those which have more total orders than "min_orders" (and were not stopped by abort rules)
+    top_reports = [x for x in all_reports if x.num_orders >= min_orders and not x.pruned][:number_of_best_values]
     
     i = 0
     while i<len(top_reports) and top_reports[i].num_orders < min_orders:
@@ -312,7 +775,7 @@ def choose_best_params_2(all_reports: SingleRunStrategyReport):
     report_id = -1
     for i in range(0, len(all_reports)):
         #take first with total enough orders that were made and positive profit
-        if all_reports[i].num_orders >= STRATEGY_MIN_ORDERS and all_reports[i].profitability > 0:
+        if all_reports[i].num_orders >= STRATEGY_MIN_ORDERS and all_reports[i].profitability > 0 and not all_reports[i].pruned:
             report_id = i
             break
     
@@ -327,14 +790,10 @@ def choose_best_params_2(all_reports: SingleRunStrategyReport):
 
 def choose_best_params_reliable(all_reports: SingleRunStrategyReport, numdays: int = 0, min_prof_ord_prcnt = STRATEGY_MIN_PROFIT_ORDERS_PERCENT):
 
-    #special case for "numdays" for running strategy tester was set to small value, so we can't expect many orders in general
-    if numdays <= 0 or numdays > 15: 
-        n_min_orders = STRATEGY_MIN_ORDERS
-    else:
-        n_min_orders = 2
+    n_min_orders = get_min_orders_reliable(numdays)
 
     all_reports.sort(reverse=True, key=lambda report: report.profitability)
-    top_reports = [x for x in all_reports if x.num_orders >= n_min_orders and x.profitability > 0][:]
+    top_reports = [x for x in all_reports if x.num_orders >= n_min_orders and x.profitability > 0 and not x.pruned][:]
 
     best_report: SingleRunStrategyReport = None
     for i in range(0, len(top_reports)):
@@ -352,19 +811,64 @@ def choose_best_params_reliable(all_reports: SingleRunStrategyReport, numdays: i
 
     return best_report
 
-def choose_best_params_weighted(all_reports: SingleRunStrategyReport, starttime: datetime, endtime: datetime):
+def get_min_orders(settings: StrategySettings, criterion: str = None) -> int:
+    '''Min number of orders of a report which choose_best_params_* for "criterion" (default - "strategy_selection" from settings) accepts'''
+    if (criterion if criterion else settings.strategy_selection) == "Reliable":
+        #"numdays" is not in settings file, it is set only by callers which test strategy on last days
+        return get_min_orders_reliable(getattr(settings, "numdays", 0))
+    return STRATEGY_MIN_ORDERS
+
+def get_min_orders_reliable(numdays: int) -> int:
+    #special case for "numdays" for running strategy tester was set to small value, so we can't expect many orders in general
+    if numdays <= 0 or numdays > 15: 
+        return STRATEGY_MIN_ORDERS
+    return 2
+
+'''
+Best params by weighted_profitability (recent orders weigh more) among reports which have at least "min_orders" orders and were not 
+stopped by abort rules. Same score as ReportsCollector keeps reports by, so the best report is never dropped during the sweep
+'''
+def choose_best_params_weighted(all_reports: list[SingleRunStrategyReport]) -> SingleRunStrategyReport:
+
+    min_orders = STRATEGY_MIN_ORDERS
+    top_reports = [x for x in all_reports if x.num_orders >= min_orders and not x.pruned]
+    if not top_reports:
+        logger.warning(f"choose_best_params_weighted(): FAIL: Not enough orders. Not a sigle parameters-set had at least {min_orders} orders made during period")
+        return None
+
+    #the first of equal reports (as stable sort in choose_best_params_profit)
+    best_report = max(top_reports, key=weighted_profitability)
+    score = weighted_profitability(best_report)
+    logger.info(f"  choose_best_params_weighted(): BEST weighted profitability: {score} (profitability: {best_report.profitability}) on params: {best_report.params}")
+    logger.info(f"  choose_best_params_weighted(): Total orders: {best_report.num_orders} ({best_report.num_profit_orders}/{best_report.num_loss_orders})")
+    if score <= 0.0:
+        return None
+
+    return best_report
+
+'''
+Best params by mean profitability of their neighbourhood in results cube (see ResultsCube.best_robust), so params 
+on a narrow peak of profitability lose to params in a stable area. Report of them is run again if it was not kept
+'''
+def choose_best_params_robust(cube: ResultsCube, all_reports: list[SingleRunStrategyReport], in_sample_candles: list[Tick], 
+                              settings: StrategySettings, instrument: Instr = None) -> SingleRunStrategyReport:
+
+    best = cube.best_robust(STRATEGY_MIN_ORDERS)
+    if best is None:
+        logger.warning(f"choose_best_params_robust(): FAIL: Not enough orders")
+        return None
+
+    params, score = best
+    logger.info(f"  choose_best_params_robust(): BEST mean profitability of neighbourhood: {score} on params: {params}")
+    if score <= 0.0:
+        return None
 
-    logger.debug(f"--> starttime = {starttime}, endtime = {endtime}")
-    for report in all_reports:
-        logger.debug(f"--> profitability was: {report.profitability}")
-        for order in report.orders_history:
-            logger.debug(f"    start={starttime}, end={endtime}, ord={order.timeClose}, profit was = {order.profit}")
-            order.profit = order.profit * get_order_profit_multiplier_exp(starttime, endtime, order.timeClose)
-            logger.debug(f"    profit now = {order.profit}")
-        report.generate_report()
-        logger.debug(f"--> profitability now: {report.profitability}")
+    best_report = next((x for x in all_reports if tuple(x.params) == params), None)
+    if best_report is None:
+        best_report = strategy_single_run(in_sample_candles, settings, params, instrument)
+    logger.info(f"  choose_best_params_robust(): Profitability: {best_report.profitability}, Total orders: {best_report.num_orders} ({best_report.num_profit_orders}/{best_report.num_loss_orders})")
 
-    return choose_best_params_profit(all_reports)
+    return best_report
 
 def get_order_profit_multiplier_linear(starttime: datetime, endtime: datetime, ordertime: datetime):
     return 1.0 + (ordertime - starttime).total_seconds()/(endtime - starttime).total_seconds()
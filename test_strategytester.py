@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from candles import Tick
+from globals import OrderDir, OrderChangeReason, STRATEGY_MIN_ORDERS
+from reports import SingleRunStrategyReport, StrategyLog
+from schemas import Order, TradeLedger, TradeRecord
+from strategytester import ReportsCollector, choose_best_params_profit, choose_best_params_weighted, score_report, weighted_profitability
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+END = START + timedelta(days=100)
+
+def make_report(params: tuple, trades: list[tuple], pruned: bool = False) -> SingleRunStrategyReport:
+    '''Report of a run with BUY orders (day of close, open price, close price) recorded in a TradeLedger as strategy tester does'''
+    ledger = TradeLedger()
+    for day, o_price, c_price in trades:
+        order = Order(OrderDir.BUY, 1, o_price, START + timedelta(days=day - 1))
+        candle = Tick(START + timedelta(days=day), c_price, c_price, c_price, c_price, 1)
+        order.close(OrderDir.BUY, candle, OrderChangeReason.UNSPECIFIED, 0, ledger)
+    report = SingleRunStrategyReport(ledger, params, 1000, StrategyLog(), START, END)
+    report.pruned = pruned
+    report.generate_report()
+    return report
+
+def make_reports() -> list[SingleRunStrategyReport]:
+    orders_num = STRATEGY_MIN_ORDERS + 1
+    return [make_report((1,), [(day, 100, 110) for day in range(1, 1 + orders_num)]),       #more profit, but long ago
+            make_report((2,), [(day, 100, 106) for day in range(90, 90 + orders_num)]),     #less profit, but recent
+            make_report((3,), [(99, 100, 150)]),                                            #too few orders
+            make_report((4,), [(day, 100, 120) for day in range(90, 90 + orders_num)], pruned=True)]
+
+def test_weighted_selection_runs_on_trade_ledger():
+    reports = make_reports()
+    assert all(isinstance(order, TradeRecord) for report in reports for order in report.orders_history)
+
+    best = choose_best_params_weighted(list(reports))
+    assert best.params == (2,)
+    assert choose_best_params_profit(list(reports)).params == (1,)
+    #selection doesn't change orders or reports
+    assert reports[0].profitability > reports[1].profitability
+    assert weighted_profitability(reports[1]) > weighted_profitability(reports[0])
+
+def test_weighted_selection_matches_collector_score():
+    reports = make_reports()
+    settings = SimpleNamespace(strategy_selection="Weighted")
+    assert max(reports[:2], key=lambda report: score_report(report, settings)) is choose_best_params_weighted(list(reports))
+
+def test_collector_keeps_weighted_best(tmp_path):
+    settings = SimpleNamespace(strategy_selection="Weighted")
+    with ReportsCollector(settings, str(tmp_path), top_k=1) as collector:
+        for report in make_reports():
+            collector.add(report)
+        kept = collector.close()
+
+    assert choose_best_params_weighted(kept).params == (2,)